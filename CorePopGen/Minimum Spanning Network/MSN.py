@@ -1,93 +1,281 @@
-import sys
 import os
+import argparse
+import hashlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 import cyvcf2
 import numpy as np
 import networkx as nx
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import breadth_first_order, connected_components
 from tqdm import tqdm
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.io as pio
 
-def process_vcf(vcf_file):
+def process_vcf(vcf_file, max_variants=None, thin=None):
+    # Alleles go straight into a preallocated int8 (variants, samples, 2) array:
+    # -1 missing, -2 padding for haploid calls. thin skips variants closer than
+    # that many bp to the last kept one on the same contig (like vcftools --thin).
     vcf = cyvcf2.VCF(vcf_file)
     sample_names = vcf.samples
-    variants = []
+    capacity = max_variants or 4096
+    variants = np.empty((capacity, len(sample_names), 2), dtype=np.int8)
+    n_variants = 0
+    last_chrom, last_pos = None, None
     
     for variant in tqdm(vcf, desc="Processing VCF"):
-        variants.append(variant.genotypes)
-    return sample_names, np.array(variants)
-
-def allelic_differences(sample1, sample2):
-    differences = 0
-    for allele1, allele2 in zip(sample1, sample2):
-        if allele1[0] != allele2[0]:
-            differences += 1
-        if allele1[1] != allele2[1]:
-            differences += 1
-    return differences
-
-def calculate_distances(variants):
+        if thin and variant.CHROM == last_chrom and variant.POS - last_pos < thin:
+            continue
+        genotype = variant.genotype
+        if genotype is None:
+            continue
+        if n_variants == capacity:
+            capacity *= 2
+            grown = np.empty((capacity, len(sample_names), 2), dtype=np.int8)
+            grown[:n_variants] = variants[:n_variants]
+            variants = grown
+        alleles = genotype.array()[:, :-1][:, :2]
+        variants[n_variants, :, :alleles.shape[1]] = alleles
+        variants[n_variants, :, alleles.shape[1]:] = -2
+        n_variants += 1
+        last_chrom, last_pos = variant.CHROM, variant.POS
+        if n_variants == max_variants:
+            break
+    vcf.close()
+    return sample_names, variants[:n_variants]
+
+def collapse_genotypes(variants):
+    # Group samples with identical multilocus genotypes (allele order ignored, missing
+    # calls must match) by hashing each sample's genotype row.
+    # Returns one list of sample indices per distinct genotype, in order of first appearance.
+    groups = {}
+    for sample in tqdm(range(variants.shape[1]), desc="Collapsing genotypes"):
+        row = np.sort(variants[:, sample], axis=1)
+        key = hashlib.blake2b(row.tobytes(), digest_size=16).digest()
+        groups.setdefault(key, []).append(sample)
+    return list(groups.values())
+
+def allele_indicators(alleles):
+    # alleles: (variants, samples, ploidy) with -1 missing and -2 padding for lower ploidy.
+    # Returns per-sample rows [comparable | shared] so that, for samples i and j,
+    # left[i] @ right[j] = allele slots compared - alleles shared = allelic differences.
+    # Loci where either sample has a missing allele are skipped.
+    n_variants, n_samples, ploidy = alleles.shape
+    slots = [np.ascontiguousarray(alleles[:, :, k].T) for k in range(ploidy)]
+    missing = np.zeros((n_samples, n_variants), dtype=bool)
+    for slot in slots:
+        missing |= slot == -1
+
+    n_alleles = int(alleles.max()) + 1
+    left = np.empty((n_samples, (n_alleles + 1) * ploidy * n_variants), dtype=np.float32)
+
+    def fill(column, count):
+        count[missing] = 0
+        for k in range(1, ploidy + 1):
+            left[:, column * n_variants:(column + 1) * n_variants] = count >= k
+            column += 1
+
+    fill(0, sum((slot >= 0).astype(np.int8) for slot in slots))
+    for allele in range(n_alleles):
+        fill((allele + 1) * ploidy, sum((slot == allele).astype(np.int8) for slot in slots))
+
+    right = left.copy()
+    right[:, ploidy * n_variants:] *= -1
+    return left, right
+
+def calculate_distances(variants, block_size=4096, threads=None):
     print("Calculating distances...")
     n_samples = variants.shape[1]
-    dist_matrix = np.zeros((n_samples, n_samples), dtype=int)
-    
-    for i in tqdm(range(n_samples), desc="Calculating distance matrix"):
-        for j in range(i + 1, n_samples):
-            dist_matrix[i, j] = allelic_differences(variants[:, i], variants[:, j])
-            dist_matrix[j, i] = dist_matrix[i, j]
-    
-    return dist_matrix
+    dist_matrix = np.zeros((n_samples, n_samples), dtype=np.int32)
+    threads = threads or os.cpu_count()
+    row_step = max(1, -(-n_samples // (threads * 4)))
+    row_blocks = [(start, min(start + row_step, n_samples)) for start in range(0, n_samples, row_step)]
+
+    def add_rows(rows, left, right):
+        start, stop = rows
+        block = left[start:stop] @ right[start:].T
+        dist_matrix[start:stop, start:] += np.rint(block).astype(np.int32)
 
-def create_graph(distances, sample_names, pop_map):
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for first in tqdm(range(0, variants.shape[0], block_size), desc="Calculating distance matrix"):
+            left, right = allele_indicators(np.asarray(variants[first:first + block_size]))
+            list(executor.map(add_rows, row_blocks, repeat(left), repeat(right)))
+
+    # Only the upper triangle was filled; mirror it
+    upper = np.triu(dist_matrix, 1)
+    return upper + upper.T
+
+def create_graph(edges, sample_names, pop_map, groups=None):
+    # groups: sample indices behind each node (collapsed genotypes); one sample per node by default
     print("Creating graph...")
+    if groups is None:
+        groups = [[i] for i in range(len(sample_names))]
     G = nx.Graph()
-    for i, name in enumerate(sample_names):
-        if name in pop_map.index:
-            G.add_node(name, site=pop_map.loc[name, 'site'])
-        else:
-            print(f"Warning: Sample {name} not found in population map. Setting site to 'Unknown'.")
-            G.add_node(name, site='Unknown')
-    for i in tqdm(range(len(sample_names)), desc="Adding edges"):
-        for j in range(i + 1, len(sample_names)):
-            G.add_edge(sample_names[i], sample_names[j], weight=distances[i, j])
+    nodes = []
+    for members in groups:
+        samples = [sample_names[i] for i in members]
+        sites = Counter()
+        unmapped = 0
+        for name in samples:
+            if name in pop_map.index:
+                sites[pop_map.loc[name, 'site']] += 1
+            else:
+                print(f"Warning: Sample {name} not found in population map. Setting site to 'Unknown'.")
+                unmapped += 1
+        # Colour by the most common known site; 'Unknown' only if no member is in the map
+        site = sites.most_common(1)[0][0] if sites else 'Unknown'
+        composition = dict(sites.most_common())
+        if unmapped:
+            composition['Unknown'] = composition.get('Unknown', 0) + unmapped
+        G.add_node(samples[0], site=site, sites=composition, size=len(samples), samples=samples)
+        nodes.append(samples[0])
+    G.add_weighted_edges_from((nodes[i], nodes[j], weight) for i, j, weight in edges)
     return G
 
-def get_minimum_spanning_tree(G):
+def get_minimum_spanning_tree(distances):
+    # Prim's algorithm on the dense distance matrix: returns the n-1 tree edges as
+    # (i, j, weight) without building the complete graph. Zero distances are edges too.
     print("Calculating minimum spanning tree...")
-    return nx.minimum_spanning_tree(G)
+    n_samples = len(distances)
+    unreached = np.iinfo(np.int64).max
+    in_tree = np.zeros(n_samples, dtype=bool)
+    best = np.full(n_samples, unreached, dtype=np.int64)
+    parent = np.zeros(n_samples, dtype=np.intp)
+    best[0] = 0
+    edges = []
+
+    for step in tqdm(range(n_samples), desc="Growing minimum spanning tree"):
+        node = int(np.argmin(best))
+        if step:
+            edges.append((int(parent[node]), node, int(best[node])))
+        in_tree[node] = True
+        best[node] = unreached
+        closer = (distances[node] < best) & ~in_tree
+        best[closer] = distances[node][closer]
+        parent[closer] = node
+    return edges
 
-def visualize_mst_interactive(mst, pop_map, output_file):
+def get_minimum_spanning_network(distances, tree_edges, block_size=1024):
+    # Minimum spanning network: going up through the distance levels used by the MST, add every
+    # edge at that level joining nodes that were in different components before the level,
+    # so equally short alternative links are kept alongside the tree.
+    print("Calculating minimum spanning network...")
+    n_nodes = len(distances)
+    levels = np.unique([weight for _, _, weight in tree_edges])
+    rows, cols = [], []
+    for start in range(0, n_nodes, block_size):
+        i, j = np.nonzero(np.isin(distances[start:start + block_size], levels))
+        upper = j > i + start
+        rows.append(i[upper] + start)
+        cols.append(j[upper])
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+    cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.intp)
+    weights = distances[rows, cols]
+    order = np.argsort(weights, kind='stable')
+    rows, cols, weights = rows[order], cols[order], weights[order]
+
+    root = np.arange(n_nodes)
+
+    def find(node):
+        while root[node] != node:
+            root[node] = root[root[node]]
+            node = root[node]
+        return node
+
+    edges = []
+    bounds = np.flatnonzero(np.diff(weights)) + 1
+    for level_rows, level_cols, level_weights in zip(np.split(rows, bounds), np.split(cols, bounds), np.split(weights, bounds)):
+        # Flatten the union-find so components are as they stood before this level
+        while True:
+            flat = root[root]
+            if (flat == root).all():
+                break
+            root = flat
+        link = root[level_rows] != root[level_cols]
+        edges.extend(zip(level_rows[link].tolist(), level_cols[link].tolist(), level_weights[link].tolist()))
+        for a, b in zip(level_rows[link], level_cols[link]):
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                root[root_a] = root_b
+    return edges
+
+def radial_tree_layout(n_nodes, edges):
+    # Radial layout of a BFS spanning tree of each connected component: the highest-degree
+    # node at the centre, BFS depth as radius and each subtree given an angular wedge
+    # proportional to its number of leaves. Components are placed side by side.
+    adjacency = csr_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(n_nodes, n_nodes))
+    degree = np.bincount(edges.ravel(), minlength=n_nodes)
+    n_components, labels = connected_components(adjacency, directed=False)
+    pos = np.zeros((n_nodes, 2))
+    depth = np.zeros(n_nodes)
+    leaves = np.zeros(n_nodes)
+    width = np.zeros(n_nodes)
+    cursor = np.zeros(n_nodes)
+    angle = np.zeros(n_nodes)
+    offset = 0.0
+
+    for component in range(n_components):
+        members = np.flatnonzero(labels == component)
+        root = members[np.argmax(degree[members])]
+        order, parent = breadth_first_order(adjacency, root, directed=False)
+
+        for node in order[1:]:
+            depth[node] = depth[parent[node]] + 1
+        for node in order[::-1]:
+            leaves[node] = max(leaves[node], 1)
+            if node != root:
+                leaves[parent[node]] += leaves[node]
+
+        width[root] = 2 * np.pi
+        for node in order[1:]:
+            up = parent[node]
+            width[node] = width[up] * leaves[node] / leaves[up]
+            cursor[node] = cursor[up]
+            angle[node] = cursor[up] + width[node] / 2
+            cursor[up] += width[node]
+
+        radius = depth[order].max()
+        pos[order, 0] = depth[order] * np.cos(angle[order]) + offset + radius
+        pos[order, 1] = depth[order] * np.sin(angle[order])
+        offset += 2 * radius + 2
+    return pos
+
+def visualize_mst_interactive(mst, pop_map, output_file, layout='radial'):
     print("Visualizing minimum spanning network...")
-    pos = nx.spring_layout(mst, k=0.5, iterations=50)
+    nodes = list(mst.nodes())
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(index[a], index[b]) for a, b in mst.edges()], dtype=np.intp).reshape(-1, 2)
+    if layout == 'spring':
+        spring = nx.spring_layout(mst, k=0.5, iterations=50)
+        pos = np.array([spring[node] for node in nodes]).reshape(-1, 2)
+    else:
+        pos = radial_tree_layout(len(nodes), edges)
     
-    sites = list(set(nx.get_node_attributes(mst, 'site').values()))
+    node_sites = [mst.nodes[node]['site'] for node in nodes]
+    node_sizes = np.array([mst.nodes[node]['size'] for node in nodes])
+    sites = list(set(node_sites))
     color_map = {site: f'rgb({np.random.randint(0,256)},{np.random.randint(0,256)},{np.random.randint(0,256)})' for site in sites}
     
-    edge_trace = go.Scatter(
-        x=[], y=[], line=dict(width=0.5, color='#888'), hoverinfo='none', mode='lines')
-    
-    for edge in mst.edges():
-        x0, y0 = pos[edge[0]]
-        x1, y1 = pos[edge[1]]
-        edge_trace['x'] += (x0, x1, None)
-        edge_trace['y'] += (y0, y1, None)
+    # One line trace for all edges, NaN-separated
+    gaps = np.full(len(edges), np.nan)
+    edge_trace = go.Scattergl(
+        x=np.column_stack([pos[edges[:, 0], 0], pos[edges[:, 1], 0], gaps]).ravel(),
+        y=np.column_stack([pos[edges[:, 0], 1], pos[edges[:, 1], 1], gaps]).ravel(),
+        line=dict(width=0.5, color='#888'), hoverinfo='none', mode='lines')
     
-    node_trace = go.Scatter(
-        x=[], y=[], text=[], mode='markers', hoverinfo='text',
-        marker=dict(showscale=False, colorscale='YlGnBu', reversescale=True, color=[], size=10,
+    node_trace = go.Scattergl(
+        x=pos[:, 0], y=pos[:, 1], mode='markers', hoverinfo='text',
+        text=[f"Sample: {node}<br>Site: {site}<br>Samples: {size}<br>" + "<br>".join(f"{name}: {count}" for name, count in mst.nodes[node]['sites'].items())
+              for node, site, size in zip(nodes, node_sites, node_sizes)],
+        marker=dict(showscale=False, colorscale='YlGnBu', reversescale=True,
+                    color=[color_map[site] for site in node_sites], size=10 * np.sqrt(node_sizes),
                     line_width=2))
     
-    for node in mst.nodes():
-        x, y = pos[node]
-        node_trace['x'] += (x,)
-        node_trace['y'] += (y,)
-        node_trace['text'] += (f"Sample: {node}<br>Site: {mst.nodes[node]['site']}",)
-        node_trace['marker']['color'] += (color_map[mst.nodes[node]['site']],)
-    
     fig = go.Figure(data=[edge_trace, node_trace],
                     layout=go.Layout(
-                        title='Minimum Spanning Network',
-                        titlefont_size=16,
+                        title=dict(text='Minimum Spanning Network', font=dict(size=16)),
                         showlegend=False,
                         hovermode='closest',
                         margin=dict(b=20,l=5,r=5,t=40),
@@ -102,7 +290,7 @@ def visualize_mst_interactive(mst, pop_map, output_file):
     
     # Add a legend
     for site, color in color_map.items():
-        fig.add_trace(go.Scatter(
+        fig.add_trace(go.Scattergl(
             x=[None], y=[None], mode='markers',
             marker=dict(size=10, color=color),
             showlegend=True, name=site
@@ -119,8 +307,8 @@ def load_population_map(csv_file):
     pop_map.set_index('id', inplace=True)
     return pop_map
 
-def main(vcf_file, pop_map_file):
-    sample_names, variants = process_vcf(vcf_file)
+def main(vcf_file, pop_map_file, msn=False, threads=None, max_variants=None, thin=None, layout='radial'):
+    sample_names, variants = process_vcf(vcf_file, max_variants, thin)
     pop_map = load_population_map(pop_map_file)
     
     # Check for mismatches between VCF samples and population map
@@ -134,22 +322,37 @@ def main(vcf_file, pop_map_file):
     if extra_samples:
         print(f"Warning: The following samples are in the population map but not in the VCF: {extra_samples}")
     
-    distances = calculate_distances(variants)
-    G = create_graph(distances, sample_names, pop_map)
-    mst = get_minimum_spanning_tree(G)
+    if msn:
+        groups = collapse_genotypes(variants)
+        print(f"Collapsed {len(sample_names)} samples into {len(groups)} multilocus genotypes")
+        distances = calculate_distances(variants[:, [members[0] for members in groups]], threads=threads)
+        edges = get_minimum_spanning_tree(distances)
+        edges = get_minimum_spanning_network(distances, edges)
+    else:
+        groups = None
+        distances = calculate_distances(variants, threads=threads)
+        edges = get_minimum_spanning_tree(distances)
+    mst = create_graph(edges, sample_names, pop_map, groups)
     
     # Generate output file name in the same directory as the VCF file
     vcf_dir = os.path.dirname(vcf_file)
     vcf_name = os.path.splitext(os.path.basename(vcf_file))[0]
     output_file = os.path.join(vcf_dir, f"{vcf_name}_MSN.html")
     
-    visualize_mst_interactive(mst, pop_map, output_file)
+    visualize_mst_interactive(mst, pop_map, output_file, layout)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python MSN.py <path_to_vcf_file> <path_to_population_map_csv>")
-        sys.exit(1)
-    
-    vcf_file = sys.argv[1]
-    pop_map_file = sys.argv[2]
-    main(vcf_file, pop_map_file)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Minimum spanning tree or network of VCF samples by allelic differences')
+    parser.add_argument('vcf_file', type=str, help='Path to the VCF file')
+    parser.add_argument('pop_map_file', type=str, help="Path to the population map CSV with 'id' and 'site' columns")
+    parser.add_argument('--msn', action='store_true',
+                        help='Collapse identical multilocus genotypes and keep equally short alternative edges (minimum spanning network)')
+    parser.add_argument('-t', '--threads', type=int, default=None, help='Threads for the distance matrix, defaults to all cores')
+    parser.add_argument('-n', '--max-variants', type=int, default=None, help='Stop after loading this many variants')
+    parser.add_argument('--thin', type=int, default=None,
+                        help='Skip variants closer than this many bp to the previous kept variant on the same contig')
+    parser.add_argument('--layout', choices=['radial', 'spring'], default='radial',
+                        help='Network layout: radial tree layout (fast, default) or networkx spring layout')
+    args = parser.parse_args()
+
+    main(args.vcf_file, args.pop_map_file, args.msn, args.threads, args.max_variants, args.thin, args.layout)
@@ -1,64 +1,512 @@
+import argparse
+import sys
 import pandas as pd
-import vcfpy
+from cyvcf2 import VCF
+from scipy.linalg import eigh
 from sklearn.decomposition import PCA
 from sklearn.discriminant_analysis import LinearDiscriminantAnalysis as LDA
-from joblib import Parallel, delayed
+from sklearn.model_selection import RepeatedStratifiedKFold
+from joblib import Parallel, delayed, dump, load
 import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+MISSING = -1  # int8 dosage sentinel for missing genotypes
+BLOCK_SIZE = 10000  # variants decoded per block
+CACHE_SUFFIX = '.dpca'  # genotype cache directory next to the VCF
+CACHE_VERSION = 1  # bump when the cached dosage encoding changes
 
 def load_population_file(population_file):
     """Load the population file and return a dictionary mapping IDs to groups."""
     pop_df = pd.read_csv(population_file, sep='\t')
     return dict(zip(pop_df['id'], pop_df['groups']))
 
-def load_vcf(vcf_file, id_to_group):
-    """Load the VCF file and return a genotype matrix and corresponding labels."""
-    reader = vcfpy.Reader.from_path(vcf_file)
-    samples = reader.header.samples.names
-    genotypes = []
-    labels = []
-
-    for record in reader:
-        row = []
-        for call in record.calls:
-            gt = call.data.get('GT', './.')
-            if gt == './.':
-                row.append(np.nan)
-            else:
-                alleles = gt.split('/')
-                row.append(sum(map(int, alleles)))
-        genotypes.append(row)
-
-    genotype_matrix = np.array(genotypes).T  # Transpose to have samples as rows
+def genotype_blocks(vcf_file, block_size=BLOCK_SIZE):
+    """Yield (snp_ids, dosages) for consecutive blocks of variants in the VCF.
+
+    Dosages are int8 arrays of shape (variants, samples) holding the number of
+    non-reference alleles in each call. Calls with any missing allele (./., .|.,
+    ./1, .) are set to MISSING. Phased, unphased and haploid calls are all read
+    from the allele array cyvcf2 builds in C, so no genotype strings are parsed.
+    """
+    vcf = VCF(vcf_file)
+    nsamples = len(vcf.samples)
+    ploidy = 2
+    alleles = np.empty((block_size, nsamples, ploidy), dtype=np.int16)
+    snp_ids = []
+
+    for record in vcf:
+        genotype = record.genotype
+        if genotype is None:
+            gt = np.full((nsamples, 1), -1, dtype=np.int16)
+        else:
+            gt = genotype.array()[:, :-1]  # drop the phasing column
+        if gt.shape[1] > ploidy:
+            if snp_ids:
+                yield snp_ids, allele_dosages(alleles[:len(snp_ids)])
+                snp_ids = []
+            ploidy = gt.shape[1]
+            alleles = np.empty((block_size, nsamples, ploidy), dtype=np.int16)
+        row = len(snp_ids)
+        alleles[row, :, :gt.shape[1]] = gt
+        alleles[row, :, gt.shape[1]:] = -2  # pad lower ploidy like cyvcf2 does
+        snp_ids.append(record.ID or '{}:{}'.format(record.CHROM, record.POS))
+        if len(snp_ids) == block_size:
+            yield snp_ids, allele_dosages(alleles)
+            snp_ids = []
+
+    if snp_ids:
+        yield snp_ids, allele_dosages(alleles[:len(snp_ids)])
+    vcf.close()
+
+def allele_dosages(alleles):
+    """Collapse a (variants, samples, ploidy) allele array into int8 dosages."""
+    dosages = (alleles > 0).sum(axis=2, dtype=np.int8)
+    dosages[(alleles == -1).any(axis=2)] = MISSING
+    return dosages
+
+def read_genotypes(vcf_file, block_size=BLOCK_SIZE):
+    """Read the whole VCF into an int8 dosage matrix of shape (SNPs, samples).
+
+    Returns the matrix, the sample names and the SNP IDs.
+    """
+    vcf = VCF(vcf_file)
+    samples = vcf.samples
+    vcf.close()
+    snp_ids = []
+    blocks = []
+    for ids, dosages in genotype_blocks(vcf_file, block_size):
+        snp_ids.extend(ids)
+        blocks.append(dosages)
+    if blocks:
+        dosages = np.concatenate(blocks)
+    else:
+        dosages = np.empty((0, len(samples)), dtype=np.int8)
+    return dosages, samples, snp_ids
+
+def file_checksum(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def replace_file(path, write):
+    """Write a file through write(handle) on a temporary name, then move it into place."""
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as handle:
+        write(handle)
+    os.replace(temporary, path)
+
+def write_cache_meta(cache_dir, meta):
+    """Write the cache key that marks the cached genotypes as valid."""
+    replace_file(os.path.join(cache_dir, 'meta.json'),
+                 lambda handle: handle.write(json.dumps(meta).encode()))
+
+def read_cache(vcf_file, cache_dir):
+    """Return (dosages, samples, snp_ids) from a cache matching the VCF, or None.
+
+    The cache matches when the VCF size and mtime are unchanged. If only the
+    mtime moved (a touch or copy), the stored SHA-256 decides. The dosages are
+    memory-mapped read-only rather than loaded.
+    """
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as handle:
+            meta = json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+    stat = os.stat(vcf_file)
+    if meta.get('version') != CACHE_VERSION or meta.get('size') != stat.st_size:
+        return None
+    if meta.get('mtime_ns') != stat.st_mtime_ns:
+        if meta.get('sha256') != file_checksum(vcf_file):
+            return None
+        meta['mtime_ns'] = stat.st_mtime_ns
+        try:
+            write_cache_meta(cache_dir, meta)
+        except OSError:
+            pass
+
+    dosages = np.load(os.path.join(cache_dir, 'dosages.npy'), mmap_mode='r')
+    with np.load(os.path.join(cache_dir, 'ids.npz')) as ids:
+        samples = ids['samples'].tolist()
+        snp_ids = ids['snp_ids'].tolist()
+    return dosages, samples, snp_ids
+
+def write_cache(vcf_file, cache_dir, stat, dosages, samples, snp_ids):
+    """Store the parsed genotypes in cache_dir, keyed by the VCF stat taken before parsing.
+
+    meta.json is removed first and written last, so an interrupted write never
+    leaves a cache that looks valid.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_file = os.path.join(cache_dir, 'meta.json')
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+
+    replace_file(os.path.join(cache_dir, 'dosages.npy'),
+                 lambda handle: np.save(handle, dosages))
+    replace_file(os.path.join(cache_dir, 'ids.npz'),
+                 lambda handle: np.savez(handle, samples=np.array(samples, dtype=str),
+                                         snp_ids=np.array(snp_ids, dtype=str)))
+    write_cache_meta(cache_dir, {'version': CACHE_VERSION,
+                                 'size': stat.st_size,
+                                 'mtime_ns': stat.st_mtime_ns,
+                                 'sha256': file_checksum(vcf_file)})
+
+def load_genotypes(vcf_file, cache_dir=None, use_cache=True):
+    """Return read_genotypes() output, reusing the on-disk cache when the VCF is unchanged.
+
+    The cache lives in cache_dir (default: '<vcf_file>.dpca'). A miss parses the
+    VCF and rewrites the cache; failing to write it only prints a warning.
+    """
+    if not use_cache:
+        return read_genotypes(vcf_file)
+    cache_dir = cache_dir or vcf_file + CACHE_SUFFIX
+
+    cached = read_cache(vcf_file, cache_dir)
+    if cached is not None:
+        return cached
+
+    stat = os.stat(vcf_file)
+    dosages, samples, snp_ids = read_genotypes(vcf_file)
+    try:
+        write_cache(vcf_file, cache_dir, stat, dosages, samples, snp_ids)
+    except OSError as error:
+        print("Warning: could not write genotype cache {}: {}".format(cache_dir, error))
+    return dosages, samples, snp_ids
+
+def load_vcf(vcf_file, id_to_group, cache_dir=None, use_cache=True):
+    """Load the VCF file and return a genotype matrix and corresponding labels.
+
+    The genotype matrix has samples as rows and holds int8 dosages, with
+    MISSING marking missing calls.
+    """
+    dosages, samples, _ = load_genotypes(vcf_file, cache_dir, use_cache)
     labels = [id_to_group.get(sample, 'Unknown') for sample in samples]
-    
-    return genotype_matrix, labels
 
-def perform_dpca(genotype_matrix, labels):
-    """Perform dPCA using PCA followed by LDA."""
+    return dosages.T, labels  # Transpose to have samples as rows
+
+def impute_missing(genotype_matrix):
+    """Return a float64 copy of the dosages with missing calls set to the SNP mean."""
+    missing = genotype_matrix == MISSING
+    genotypes = np.where(missing, 0, genotype_matrix).astype(np.float64)
+    called = genotype_matrix.shape[0] - missing.sum(axis=0)
+    means = genotypes.sum(axis=0) / np.maximum(called, 1)
+    return np.where(missing, means, genotypes)
+
+def center_dosages(dosages):
+    """Center a (SNPs, samples) dosage block on its SNP means.
+
+    Returns the centered block with samples as rows, missing calls imputed to
+    the mean (so 0 after centering), and the SNP means.
+    """
+    missing = dosages == MISSING
+    called = dosages.shape[1] - missing.sum(axis=1)
+    means = np.where(missing, 0, dosages).sum(axis=1) / np.maximum(called, 1)
+    centered = dosages.T - means
+    centered[missing.T] = 0
+    return centered, means
+
+def incremental_pca(blocks, n_components=10):
+    """Incremental PCA of the centered genotype matrix streamed in SNP blocks.
+
+    Each block's samples x samples cross-product is added to a running Gram
+    matrix, so only the SNP means and that samples x samples matrix are kept in
+    memory, whatever the number of SNPs. A single eigendecomposition at the end
+    gives exact PC scores (as PCA.fit_transform would, up to sign), returned
+    with the SNP means.
+    """
+    gram = None
+    means = []
+
+    for dosages in blocks:
+        centered, block_means = center_dosages(dosages)
+        means.append(block_means)
+        if gram is None:
+            gram = centered @ centered.T
+        else:
+            gram += centered @ centered.T
+
+    if gram is None:
+        raise ValueError('No variants to decompose')
+    nsamples = gram.shape[0]
+    keep = min(n_components, nsamples)
+    values, vectors = eigh(gram, subset_by_index=(nsamples - keep, nsamples - 1))
+    pcs = vectors[:, ::-1] * np.sqrt(np.clip(values[::-1], 0, None))
+    return pcs, np.concatenate(means)
+
+def perform_lda(pca_result, labels):
+    """Fit LDA on the retained PCs and return the discriminant coordinates.
+
+    Samples labelled None are left out of the fit but still projected.
+    """
+    known = np.array([label is not None for label in labels], dtype=bool)
+    known_labels = [label for label in labels if label is not None]
+    lda = LDA(n_components=min(2, len(set(known_labels)) - 1, pca_result.shape[1]))
+    lda.fit(pca_result[known], known_labels)
+    return lda.transform(pca_result)
+
+def compute_pcs(genotype_matrix, n_components=10):
+    """Mean-impute the dosages and return the PC scores of the samples."""
     # Fill missing values with the mean of each column
-    genotype_matrix = np.nan_to_num(genotype_matrix, nan=np.nanmean(genotype_matrix, axis=0))
-    
-    # Perform PCA
-    pca = PCA(n_components=10)
-    pca_result = pca.fit_transform(genotype_matrix)
+    genotype_matrix = impute_missing(genotype_matrix)
+
+    pca = PCA(n_components=n_components)
+    return pca.fit_transform(genotype_matrix)
+
+def streaming_pcs(vcf_file, n_components=10, block_size=BLOCK_SIZE, dosages=None):
+    """Return PC scores from an incremental PCA over SNP blocks read from the VCF.
+
+    The genotype matrix is never held in memory, so this scales to whole-genome
+    SNP sets. A memory-mapped (SNPs, samples) dosages array, such as a cached
+    one, is streamed instead of the VCF when given.
+    """
+    if dosages is None:
+        blocks = (block for _, block in genotype_blocks(vcf_file, block_size))
+    else:
+        blocks = (dosages[start:start + block_size] for start in range(0, len(dosages), block_size))
+    pca_result, _ = incremental_pca(blocks, n_components=n_components)
+    return pca_result
+
+def perform_dpca(genotype_matrix, labels, n_components=10):
+    """Perform dPCA using PCA followed by LDA."""
+    return perform_lda(compute_pcs(genotype_matrix, n_components), labels)
+
+def perform_streaming_dpca(vcf_file, labels, n_components=10, block_size=BLOCK_SIZE, dosages=None):
+    """Perform dPCA with an incremental PCA over SNP blocks (see streaming_pcs)."""
+    return perform_lda(streaming_pcs(vcf_file, n_components, block_size, dosages), labels)
+
+def score_fold(genotypes, labels, train, test, pc_counts):
+    """Fit PCA+LDA on one training fold and return held-out accuracy per PC count.
+
+    Missing calls in both folds are imputed with the training SNP means. PCA is
+    fitted once with the largest PC count; smaller counts use its leading PCs.
+    """
+    train_matrix = impute_missing(genotypes[train])
+    test_matrix = genotypes[test]
+    test_matrix = np.where(test_matrix == MISSING, train_matrix.mean(axis=0), test_matrix)
+
+    pca = PCA(n_components=max(pc_counts))
+    train_pcs = pca.fit_transform(train_matrix)
+    test_pcs = pca.transform(test_matrix)
+
+    scores = []
+    for n_pcs in pc_counts:
+        lda = LDA().fit(train_pcs[:, :n_pcs], labels[train])
+        scores.append(lda.score(test_pcs[:, :n_pcs], labels[test]))
+    return scores
+
+def cross_validate_pcs(genotype_matrix, labels, pc_counts, folds=5, repeats=1, n_jobs=-1, seed=None):
+    """Score held-out group assignment of PCA+LDA for each number of retained PCs.
+
+    Stratified k-fold splits (optionally repeated) are fitted in parallel. The
+    int8 genotype matrix is dumped once and memory-mapped by every worker
+    instead of being pickled per job. Samples labelled None are left out.
+    Returns a DataFrame with the mean and SD of accuracy per PC count.
+    """
+    known = np.array([label is not None for label in labels], dtype=bool)
+    labels = np.array([label for label in labels if label is not None])
+    nknown = len(labels)
+    max_pcs = min(genotype_matrix.shape[1], nknown - (nknown + folds - 1) // folds)
+    dropped = sorted({n for n in pc_counts if n > max_pcs})
+    if dropped:
+        print("Warning: ignoring PC counts {}: training folds allow at most {} PCs".format(' '.join(map(str, dropped)), max_pcs))
+    pc_counts = sorted({n for n in pc_counts if 0 < n <= max_pcs})
+    if not pc_counts:
+        raise ValueError('No PC counts between 1 and {}'.format(max_pcs))
+
+    folder = tempfile.mkdtemp(prefix='dpca_')
+    try:
+        filename = os.path.join(folder, 'genotypes.mmap')
+        dump(np.ascontiguousarray(genotype_matrix[known]), filename)
+        genotypes = load(filename, mmap_mode='r')
+        splitter = RepeatedStratifiedKFold(n_splits=folds, n_repeats=repeats, random_state=seed)
+        scores = Parallel(n_jobs=n_jobs)(
+            delayed(score_fold)(genotypes, labels, train, test, pc_counts)
+            for train, test in splitter.split(np.zeros(len(labels)), labels))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    scores = np.array(scores)
+    return pd.DataFrame({'n_pcs': pc_counts,
+                         'mean_accuracy': scores.mean(axis=0),
+                         'sd_accuracy': scores.std(axis=0)})
+
+def load_grouping_schemes(population_files, columns=None, id_column='id'):
+    """Return {scheme: {id: group}} for each grouping column of each population file.
+
+    Files ending in .csv are comma-separated, anything else tab-separated. By
+    default every column other than id_column is a grouping scheme, named
+    '<file stem>.<column>'. Samples with no group in a column are left out of
+    that scheme.
+    """
+    schemes = {}
+    for population_file in population_files:
+        sep = ',' if population_file.lower().endswith('.csv') else '\t'
+        pop_df = pd.read_csv(population_file, sep=sep, dtype=str, encoding='utf-8-sig')
+        if id_column not in pop_df.columns:
+            raise ValueError("{} has no '{}' column".format(population_file, id_column))
+
+        stem = os.path.splitext(os.path.basename(population_file))[0]
+        for column in columns or [c for c in pop_df.columns if c != id_column]:
+            if column not in pop_df.columns:
+                raise ValueError("{} has no '{}' column".format(population_file, column))
+            groups = pop_df[[id_column, column]].dropna()
+            schemes['{}.{}'.format(stem, column)] = dict(zip(groups[id_column], groups[column]))
+    return schemes
+
+def fit_schemes(pca_result, samples, schemes, genotype_matrix=None, pc_counts=None, folds=5, repeats=1,
+                n_jobs=-1, seed=None):
+    """Fit LDA on the shared PCs for every grouping scheme.
+
+    Samples with no group in a scheme are left out of its LDA fit (and its
+    cross-validation) but are still projected, and are written with an empty
+    group. With pc_counts (and the genotype matrix), the number of PCs is
+    chosen per scheme by cross_validate_pcs(), whose splits are drawn from
+    seed so that a fixed seed always picks the same count. Schemes that
+    cannot be fitted are reported and skipped. Returns a long
+    DataFrame with one row per sample and scheme holding its group, the PCs
+    used and the LD coordinates.
+    """
+    frames = []
+    for scheme, id_to_group in schemes.items():
+        labels = [id_to_group.get(sample) for sample in samples]
+        if len(set(labels) - {None}) < 2:
+            print("Skipping {}: fewer than two groups among the VCF samples".format(scheme))
+            continue
+
+        n_pcs = pca_result.shape[1]
+        try:
+            if pc_counts:
+                print("Cross-validation for {}:".format(scheme))
+                cv = cross_validate_pcs(genotype_matrix, labels, [n for n in pc_counts if n <= n_pcs],
+                                        folds, repeats, n_jobs, seed)
+                print(cv.to_string(index=False))
+                n_pcs = int(cv.loc[cv['mean_accuracy'].idxmax(), 'n_pcs'])
+            coordinates = perform_lda(pca_result[:, :n_pcs], labels)
+        except ValueError as error:
+            print("Skipping {}: {}".format(scheme, error))
+            continue
+        frame = pd.DataFrame({'sample': samples, 'scheme': scheme, 'group': labels, 'n_pcs': n_pcs})
+        for axis in range(coordinates.shape[1]):
+            frame['LD{}'.format(axis + 1)] = coordinates[:, axis]
+        frames.append(frame)
+
+    if not frames:
+        raise ValueError('No grouping scheme could be fitted')
+    return pd.concat(frames, ignore_index=True)
+
+def write_coordinates(frame, output_file, output_format=None):
+    """Write the per-sample coordinates as CSV or Parquet (chosen by extension by default)."""
+    if output_format is None:
+        output_format = 'parquet' if output_file.lower().endswith('.parquet') else 'csv'
+    if output_format == 'parquet':
+        frame.to_parquet(output_file, index=False)
+    else:
+        frame.to_csv(output_file, index=False)
+
+def main():
+    parser = argparse.ArgumentParser(description='dPCA (PCA followed by LDA) of VCF genotypes for one or more population grouping schemes')
+    parser.add_argument('-v', '--vcf', type=str, required=True, help='Input VCF (plain or bgzipped)')
+    parser.add_argument('-p', '--populations', type=str, nargs='+', required=True,
+                        help='Population files (TSV, or CSV if named .csv) with an id column and one or more grouping columns')
+    parser.add_argument('-c', '--columns', type=str, nargs='+', required=False,
+                        help='Grouping columns to use, defaults to every column except the id column')
+    parser.add_argument('--id-column', type=str, default='id', help="Sample ID column, defaults to 'id'")
+    parser.add_argument('-n', '--components', type=int, default=10, help='Number of PCs passed to LDA, defaults to 10')
+    parser.add_argument('--cv-pcs', type=int, nargs='+', required=False,
+                        help='Candidate PC counts; picks the best per scheme by cross-validated LDA accuracy')
+    parser.add_argument('--folds', type=int, default=5, help='Cross-validation folds, defaults to 5')
+    parser.add_argument('--repeats', type=int, default=1,
+                        help='Times the cross-validation is repeated with different splits, defaults to 1')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the cross-validation splits, defaults to 0')
+    parser.add_argument('-t', '--threads', type=int, default=-1, help='Parallel cross-validation jobs, defaults to all cores')
+    parser.add_argument('-s', '--streaming', action='store_true',
+                        help='Incremental PCA over SNP blocks instead of loading the genotype matrix')
+    parser.add_argument('--cache-dir', type=str, required=False,
+                        help="Genotype cache directory, defaults to '<vcf>{}'".format(CACHE_SUFFIX))
+    parser.add_argument('--no-cache', action='store_true', help='Neither read nor write the genotype cache')
+    parser.add_argument('-o', '--output', type=str, required=True, help='Output coordinates (.csv or .parquet)')
+    parser.add_argument('-f', '--format', type=str, choices=['csv', 'parquet'], required=False,
+                        help='Output format, defaults to the output file extension')
+    args = parser.parse_args()
+
+    if args.streaming and args.cv_pcs:
+        print('--cv-pcs needs the genotype matrix and cannot be used with --streaming')
+        sys.exit()
+
+    try:
+        schemes = load_grouping_schemes(args.populations, args.columns, args.id_column)
+    except ValueError as error:
+        print(error)
+        sys.exit()
+
+    # Parse and decompose the genotypes once for every grouping scheme
+    cache_dir = args.cache_dir or args.vcf + CACHE_SUFFIX
+    genotype_matrix = None
+    if args.streaming:
+        # Stream from the cache if a previous run left one, but never build it here
+        cached = None if args.no_cache else read_cache(args.vcf, cache_dir)
+        if cached is None:
+            vcf = VCF(args.vcf)
+            samples, dosages = vcf.samples, None
+            vcf.close()
+        else:
+            dosages, samples, _ = cached
+    else:
+        dosages, samples, _ = load_genotypes(args.vcf, cache_dir, not args.no_cache)
+        genotype_matrix = dosages.T  # Transpose to have samples as rows
+    if dosages is not None and dosages.shape[0] == 0:
+        print('No usable variants in {}'.format(args.vcf))
+        sys.exit()
 
-    # Perform LDA
-    lda = LDA(n_components=2)
-    lda_result = lda.fit_transform(pca_result, labels)
-    
-    return lda_result
+    # PCA cannot return more PCs than there are samples or SNPs
+    max_components = len(samples) if dosages is None else min(dosages.shape)
+    components = min(args.components, max_components)
+    if components < args.components:
+        print("Warning: only {} PCs available, using {} instead of {}".format(max_components, components, args.components))
+    cv_pcs = None
+    if args.cv_pcs:
+        cv_pcs = [n for n in args.cv_pcs if n <= max_components]
+        dropped = sorted(set(args.cv_pcs) - set(cv_pcs))
+        if dropped:
+            print("Warning: ignoring --cv-pcs {}: only {} PCs available".format(' '.join(map(str, dropped)), max_components))
+        if not cv_pcs:
+            print("No --cv-pcs value is at most {}".format(max_components))
+            sys.exit()
+    n_components = max([components] + (cv_pcs or []))
 
-def main(vcf_file, population_file):
-    id_to_group = load_population_file(population_file)
-    genotype_matrix, labels = load_vcf(vcf_file, id_to_group)
+    if args.streaming:
+        # Without a cache the variants are only counted while streaming them
+        try:
+            pca_result = streaming_pcs(args.vcf, n_components, dosages=dosages)
+        except ValueError:
+            print('No usable variants in {}'.format(args.vcf))
+            sys.exit()
+    else:
+        pca_result = compute_pcs(genotype_matrix, n_components)
+    if not cv_pcs:
+        pca_result = pca_result[:, :components]
 
-    # Perform dPCA using multithreading
-    result = Parallel(n_jobs=-1)(delayed(perform_dpca)(genotype_matrix, labels))
+    try:
+        coordinates = fit_schemes(pca_result, samples, schemes, genotype_matrix,
+                                  cv_pcs, args.folds, args.repeats, args.threads, args.seed)
+    except ValueError as error:
+        print(error)
+        sys.exit()
 
-    print("dPCA Result:")
-    print(result)
+    try:
+        write_coordinates(coordinates, args.output, args.format)
+    except ImportError:
+        print('Writing Parquet needs pyarrow or fastparquet installed')
+        sys.exit()
+    print('Wrote {} schemes for {} samples to {}'.format(coordinates['scheme'].nunique(), len(samples), args.output))
 
 if __name__ == "__main__":
-    vcf_file = 'path/to/your/input.vcf'
-    population_file = 'path/to/your/population.tsv'
-    main(vcf_file, population_file)
\ No newline at end of file
+    main()
@@ -1,113 +1,312 @@
 #!/usr/bin/env python3
 
 import argparse
+import multiprocessing
+import re
 import time
 import sys
+from multiprocessing import shared_memory
+from pathlib import Path
 
 # To count invariant sites for Stamatakis correction
 from collections import Counter
 
-# Creates dataframe from PHYLIP input file; need pandas library
-import pandas as pd
+# Holds the alignment as a matrix of bytes; need numpy library
 import numpy as np
 
-# For reading PHYLIP input file; need biopython library
-from Bio import AlignIO
-
 def Get_Arguments():
 
     parser = argparse.ArgumentParser(description="Does ascertainment bias correction for RAxML and does Felsenstein and Stamatakis counts")
 
     parser.add_argument("-p", "--phylip", type=str, required=True, help="Input PHYLIP filename")
+    parser.add_argument("-s", "--strict", action="store_true",
+                        help="Input is strict PHYLIP, with sequence names in the first 10 characters of the line; Default = relaxed PHYLIP, names end at the first whitespace")
     parser.add_argument("-o", "--outfile", type=str, required=False,
                         help="Output filename; invariant site count filenames will append .felsenstein and .stamatakis; Default = out.phy",
                         nargs="?", default="out.phy")
+    parser.add_argument("-i", "--interleaved", type=int, required=False, default=0,
+                        help="Write interleaved PHYLIP in blocks of this many sites; Default = sequential PHYLIP")
+    parser.add_argument("-t", "--threads", type=int, required=False, default=1,
+                        help="Number of processes classifying blocks of columns in parallel; Default = 1")
+    parser.add_argument("-m", "--max-memory", type=int, required=False,
+                        help="Maximum memory in MB for the alignment; larger alignments are processed out of core in blocks of columns, and must be sequential PHYLIP with one line per sequence; Default = whole alignment in memory")
 
     args = parser.parse_args()
 
     return args
 
-# Uses AlignIO to read input PHYLIP file
-def Read_Alignment(infile):
+# Size of the buffer for writing the output PHYLIP file
+WRITE_BUFFER = 8 * 1024 * 1024
 
-    my_id_list = []
-    with open(infile) as fin:
-        # from Bio import AlignIO
-        alignment = AlignIO.read(fin, "phylip-relaxed")
-        for record in alignment:
-            id = record.id
-            seq = record.seq
-            my_id_list.append(id)
+# Bases tracked in the per-column bitmasks, one bit each in this order
+bases = "AGCTRYSWKMBDHV"
+IUPAC_bases = "RYSWKMBDHV"
+IUPAC_dict = {'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'K': 'GT', 'M': 'AC', 'N': 'ACGT', 'S': 'CG', 'R': 'AG', 'W': 'AT', 'V': 'ACG', 'Y': 'CT', 'X': 'ACGT'}
+
+# Bit of each character (either case) of the alignment; N, "-" and any other character have none
+BASE_BITS = np.zeros(256, dtype=np.uint16)
+for i, base in enumerate(bases):
+    BASE_BITS[ord(base)] = BASE_BITS[ord(base.lower())] = 1 << i
+ACGT_MASK = np.uint16(0b1111)
+IUPAC_MASK = np.uint16(((1 << len(bases)) - 1) ^ 0b1111)
+
+# Number of bases present in a mask, and the bits of A, C, G or T compatible with a single IUPAC base
+POPCOUNT = np.array([bin(mask).count("1") for mask in range(1 << len(bases))], dtype=np.uint8)
+IUPAC_EXPANSION = np.zeros(1 << len(bases), dtype=np.uint16)
+for base in IUPAC_bases:
+    for nucleotide in IUPAC_dict[base]:
+        IUPAC_EXPANSION[1 << bases.index(base)] |= 1 << bases.index(nucleotide)
+
+# Reads the number of sequences and sites from the first line of an open PHYLIP file
+def Read_Header(fin):
+
+    header = fin.readline().split()
+    if len(header) != 2 or not header[0].isdigit() or not header[1].isdigit():
+        print("\nFirst line of PHYLIP file should have the number of sequences and their length\n")
+        sys.exit()
+
+    return int(header[0]), int(header[1])
 
-        matrix = [[char for char in seq] for seq in alignment]  # 2d list
+# Reads sequential or interleaved PHYLIP file straight into a preallocated uint8 matrix, one byte per base
+# The matrix can be given already allocated, in shared memory for example
+def Read_Alignment(infile, strict=False, matrix=None):
+
+    my_id_list = []
+    with open(infile, "rb") as fin:
+        nseqs, nsites = Read_Header(fin)
+        if matrix is None:
+            matrix = np.empty((nseqs, nsites), dtype=np.uint8)
+        filled = [0] * nseqs
+
+        # The first block holds the names of the sequences, following blocks (interleaved) only more sites
+        i = 0
+        for line in fin:
+            line = line.rstrip()
+            if not line:
+                continue
+            if len(my_id_list) < nseqs:
+                if strict:
+                    id, seq = line[:10].strip(), line[10:]
+                else:
+                    id, seq = (line.split(None, 1) + [b""])[:2]
+                my_id_list.append(id.decode())
+            else:
+                seq = line
+            seq = seq.translate(None, b" \t")
+            if filled[i] + len(seq) > nsites:
+                print("\nSequence '{}' is longer than {} sites\n".format(my_id_list[i], nsites))
+                sys.exit()
+            matrix[i, filled[i]:filled[i] + len(seq)] = np.frombuffer(seq, dtype=np.uint8)
+            filled[i] += len(seq)
+            i = (i + 1) % nseqs
+
+    if len(my_id_list) != nseqs:
+        print("\nFound {} sequences instead of {}\n".format(len(my_id_list), nseqs))
+        sys.exit()
+    for id, length in zip(my_id_list, filled):
+        if length != nsites:
+            print("\nSequence '{}' has {} sites instead of {}\n".format(id, length, nsites))
+            sys.exit()
 
     return matrix, my_id_list
 
-# Identifies and drops invariant columns from pandas DataFrame
-def filter_invariants(dframe):
-    initial_dframe_shape=dframe.shape
-    bases = ["A","G","C","T","R","Y","S","W","K","M","B","D","H","V"]
-    IUPAC_bases = ["R","Y","S","W","K","M","B","D","H","V","N"]
-    IUPAC_dict = {'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'K': 'GT', 'M': 'AC', 'N': 'ACGT', 'S': 'CG', 'R': 'AG', 'W': 'AT', 'V': 'ACG', 'Y': 'CT', 'X': 'ACGT'}
-    
+# Bitmask of the bases present in each column, ORing the bits of the samples one row at a time
+def column_masks(matrix):
+    masks = np.zeros(matrix.shape[1], dtype=np.uint16)
+    for row in matrix:
+        masks |= BASE_BITS[row]
+    return masks
+
+# Identifies invariant columns from their bitmasks, without looping over columns
+def classify_columns(masks):
+
+    acgt = masks & ACGT_MASK
+    iupac = masks & IUPAC_MASK
+    acgt_count = POPCOUNT[acgt]
+    iupac_count = POPCOUNT[iupac]
+
+    # If site is invariant (only one base, ignores N's and "-"), for Felsenstein and Stamatakis counts
+    single = (acgt_count + iupac_count) == 1
+
+    # Column considered invariant because of a pattern like AAAAAARAAAAA (R being A or G)
+    compatible = (iupac_count == 1) & (acgt_count == 1) & ((acgt & IUPAC_EXPANSION[iupac]) != 0)
+
+    # Also invariant if the column contains only ambiguous characters or more than one IUPAC base
+    invariant = (masks == 0) | single | compatible | (iupac_count > 1)
 
     # collections::Counter library
     stamatakis_cnt = Counter()
+    single_masks = masks[single]
+    for i, base in enumerate(bases):
+        count = int(np.count_nonzero(single_masks == (1 << i)))
+        if count:
+            stamatakis_cnt[base] += count
+    fels_cnt = len(single_masks)
+
+    return invariant, stamatakis_cnt, fels_cnt, int(np.count_nonzero(compatible))
+
+# Merges the classifications of consecutive ranges of columns, in the order given
+def merge_classifications(results):
+
+    invariants = [np.zeros(0, dtype=bool)]
+    stamatakis_cnt = Counter()
     fels_cnt = 0
+    compatible_cnt = 0
+    for invariant, range_stamatakis, range_fels, range_compatible in results:
+        invariants.append(invariant)
+        stamatakis_cnt.update(range_stamatakis)
+        fels_cnt += range_fels
+        compatible_cnt += range_compatible
+
+    return np.concatenate(invariants), stamatakis_cnt, fels_cnt, compatible_cnt
+
+# Splits the columns into ranges [first, last) of at most 'size' columns
+def column_ranges(nsites, size):
+    return [(first, min(first + size, nsites)) for first in range(0, nsites, size)]
+
+# Attaches a worker process to the alignment matrix in shared memory, without copying it
+def attach_matrix(name, shape):
+    global worker_shm, worker_matrix
+    worker_shm = shared_memory.SharedMemory(name=name)
+    worker_matrix = np.ndarray(shape, dtype=np.uint8, buffer=worker_shm.buf)
+
+# Classifies a range of columns of the shared alignment matrix in a worker process
+def classify_matrix_range(column_range):
+    first, last = column_range
+    return classify_columns(column_masks(worker_matrix[:, first:last]))
+
+# Identifies invariant columns of the alignment matrix, returning a boolean array of the columns kept
+# With more than one thread the matrix must be in shared memory 'shm', and ranges of columns are
+# classified by a pool of processes
+def filter_invariants(matrix, threads=1, shm=None):
+    initial_matrix_shape = matrix.shape
+
+    if threads > 1:
+        # A few ranges per process to balance the work
+        ranges = column_ranges(matrix.shape[1], max(1, -(-matrix.shape[1] // (threads * 4))))
+        with multiprocessing.Pool(threads, attach_matrix, (shm.name, matrix.shape)) as pool:
+            invariant, stamatakis_cnt, fels_cnt, compatible_cnt = merge_classifications(pool.imap(classify_matrix_range, ranges))
+    else:
+        invariant, stamatakis_cnt, fels_cnt, compatible_cnt = classify_columns(column_masks(matrix))
+
+    # Invariant sites are dropped when writing the matrix
+    keep = ~invariant
+    print("## dimensions of the initial alignment (samples, nr of positions):", initial_matrix_shape)
+    print("##", compatible_cnt, "sites with a single base and a compatible IUPAC base")
+    print("##", int(np.count_nonzero(invariant)), "invariable sites removed")
+    print("## dimensions of the remaining alignment (samples, nr of positions):", (initial_matrix_shape[0], int(np.count_nonzero(keep))))
+    return stamatakis_cnt, fels_cnt, keep
+
+# Sequence name and whitespace before the sequence in a relaxed PHYLIP line
+RELAXED_NAME = re.compile(rb"[ \t]*(\S+)[ \t]+")
+
+# Finds where each sequence starts in the PHYLIP file, reading it in chunks of 'chunk_size' bytes
+# Only sequential PHYLIP with each sequence in a single line (and no spaces inside) can be indexed
+def Index_Alignment(fin, strict=False, chunk_size=1024 * 1024):
+
+    nseqs, nsites = Read_Header(fin)
+
+    # Start and end of every line, found without holding more than a chunk of the file
+    lines = []
+    line_start = pos = fin.tell()
+    while True:
+        chunk = fin.read(chunk_size)
+        if not chunk:
+            lines.append((line_start, pos))
+            break
+        i = chunk.find(b"\n")
+        while i != -1:
+            lines.append((line_start, pos + i))
+            line_start = pos + i + 1
+            i = chunk.find(b"\n", i + 1)
+        pos += len(chunk)
 
-    invariant_lst = list()
-    # Loop through each dataframe column
-    for i in dframe.columns:
-    
-        # Gets unique values at each column and saves to list
-        column_unique = [x.upper() for x in dframe[i].unique().tolist()]
-    
-        # Intersects column_unique with bases list
-        intersect = [value for value in bases if value in column_unique]
-    
-        # If column contains only ambigous or IUPAC characters
-        # Save the column index for dropping later
-        if not any(value for value in bases if value in column_unique):
-            invariant_lst.append(i)
-    
-        # If site is invariant (only A, C, G, or T); ignores N's and "-"
-        if len(intersect) == 1:
-            # Uses collections::Counter to get Stamatakis counts
-            stamatakis_cnt[intersect[0]] += 1
-    
-            # Counts number of invariant sites for Felsenstein count
-            fels_cnt += 1
-    
-            # Saves column indexes to list
-            invariant_lst.append(i)
-    
-        # Assesses whether the column is considered invariate because a pattern like AAAAAARAAAAA (R being A or G)
-        # Save the column index for dropping later
-        IUPAC_bases_this_column = [x for x in intersect if x in IUPAC_bases]
-        column_unique_without_IUPAC = [x for x in intersect if x not in IUPAC_bases_this_column]
-    
-        if len(IUPAC_bases_this_column) == 1 and \
-            len(column_unique_without_IUPAC) == 1 and \
-            column_unique_without_IUPAC[0] in list(IUPAC_dict[IUPAC_bases_this_column[0]]):  
-            ## if 1 IUPAC base AND 1 non-IUPAC base AND the non-IUPAC base is part of the IUPAC base set stored in IUPAC_dict
-            print(column_unique_without_IUPAC[0])
-            invariant_lst.append(i)
-        if len(IUPAC_bases_this_column) > 1: 
-            ## if there are more than one IUPAC bases in this column
-            invariant_lst.append(i)
-
-    # Drops invariant sites from dataframe
-    invariant_set=set(invariant_lst)
-    dframe.drop(invariant_set, axis=1, inplace=True)
-    print("## dimensions of the initial alignment (samples, nr of positions):",initial_dframe_shape)
-    print("##",len(invariant_set), "invariable sites removed")
-    print("## dimensions of the remaining alignment (samples, nr of positions):", dframe.shape)
-    return stamatakis_cnt, fels_cnt, dframe
+    my_id_list = []
+    starts = []
+    for line_start, line_end in lines:
+        fin.seek(line_start)
+        head = fin.read(min(line_end - line_start, 1024))
+        # Skip blank lines
+        if not head.strip():
+            continue
+        if len(my_id_list) == nseqs:
+            break
+        if strict:
+            id, seq_start = head[:10].strip(), line_start + 10
+        else:
+            match = RELAXED_NAME.match(head)
+            if match is None:
+                print("\nLine {} of PHYLIP file has no sequence\n".format(len(my_id_list) + 2))
+                sys.exit()
+            id, seq_start = match.group(1), line_start + match.end()
+        fin.seek(max(seq_start, line_end - 16))
+        tail = fin.read(line_end - max(seq_start, line_end - 16))
+        line_end -= len(tail) - len(tail.rstrip())
+        if line_end - seq_start != nsites:
+            print("\nSequence '{}' is not in a single line of {} sites, use more --max-memory to read it in memory\n".format(id.decode(), nsites))
+            sys.exit()
+        my_id_list.append(id.decode())
+        starts.append(seq_start)
+
+    if len(my_id_list) != nseqs:
+        print("\nFound {} sequences instead of {}\n".format(len(my_id_list), nseqs))
+        sys.exit()
+
+    return my_id_list, starts, nsites
+
+# Reads the sites [first, last) of the sequence starting at 'start' as a uint8 array
+def read_sites(fin, start, first, last):
+    fin.seek(start + first)
+    return np.frombuffer(fin.read(last - first), dtype=np.uint8)
+
+# Block of columns [first, last) of the alignment in the file as a uint8 matrix
+def read_block(fin, starts, first, last):
+    block = np.empty((len(starts), last - first), dtype=np.uint8)
+    for i, start in enumerate(starts):
+        block[i] = read_sites(fin, start, first, last)
+    return block
+
+# Opens the alignment file in a worker process, to read its blocks of columns
+def open_alignment(infile, starts):
+    global worker_fin, worker_starts
+    worker_fin = open(infile, "rb", buffering=0)
+    worker_starts = starts
+
+# Classifies a block of columns read from the alignment file
+def classify_file_block(column_range):
+    first, last = column_range
+    return classify_columns(column_masks(read_block(worker_fin, worker_starts, first, last)))
+
+# Identifies invariant columns of an alignment larger than memory, one block of columns at a time
+# Returns the counts and a boolean array of the columns kept instead of the filtered alignment
+# With more than one thread the blocks are read and classified by a pool of processes
+def filter_invariants_blocks(infile, starts, nsites, block_size, threads=1):
+
+    ranges = column_ranges(nsites, block_size)
+    if threads > 1:
+        with multiprocessing.Pool(threads, open_alignment, (infile, starts)) as pool:
+            invariant, stamatakis_cnt, fels_cnt, compatible_cnt = merge_classifications(pool.imap(classify_file_block, ranges))
+    else:
+        open_alignment(infile, starts)
+        invariant, stamatakis_cnt, fels_cnt, compatible_cnt = merge_classifications(map(classify_file_block, ranges))
+        worker_fin.close()
+    keep = ~invariant
+
+    print("## dimensions of the initial alignment (samples, nr of positions):", (len(starts), nsites))
+    print("##", compatible_cnt, "sites with a single base and a compatible IUPAC base")
+    print("##", nsites - int(np.count_nonzero(keep)), "invariable sites removed")
+    print("## dimensions of the remaining alignment (samples, nr of positions):", (len(starts), int(np.count_nonzero(keep))))
+    return stamatakis_cnt, fels_cnt, keep
 
 # Writes three output files: *.phy, *.phy.stamatakis, *.phy.felsenstein
-def write_output(dframe, outfile, ids, st, fel):
+def write_output(matrix, keep, outfile, ids, st, fel, interleaved=0):
+
+    write_phylip(matrix, keep, outfile, ids, interleaved) # Write kept columns of matrix to PHYLIP outfile
 
-    write_phylip(dframe, outfile, ids) # Write DataFrame to PHYLIP outfile
+    write_counts(outfile, st, fel)
+
+# Writes the invariant site counts for Felsenstein and Stamatakis corrections
+def write_counts(outfile, st, fel):
 
     felsenstein = (outfile + ".felsenstein")
     with open(felsenstein, "w") as fout:
@@ -118,44 +317,130 @@ def write_output(dframe, outfile, ids, st, fel):
         # Write number of invariant sites containing A C G T to outfile
         fout.write(str(st["A"]) + " " + str(st["C"]) + " " + str(st["G"]) + " " + str(st["T"]) + "\n")
 
-# Writes only variant sites to output file
-def write_phylip(dframe, outfile, ids):
-    df_size = dframe.shape
+# Names of the sequences as written before their sites, followed by a tab
+# Sequences shorter than 15 sites are right-aligned as with "{:>15}"
+def phylip_names(ids, nkept):
+    return [(str(sample) + "\t" + " " * (15 - nkept)).encode() for sample in ids]
+
+# Writes only variant sites to output file, indexing the rows of the matrix with the mask of kept columns
+# Interleaved output holds blocks of 'interleaved' sites of every sequence, the first one with the names
+def write_phylip(matrix, keep, outfile, ids, interleaved=0):
+    columns = np.flatnonzero(keep)
+    nkept = len(columns)
+
+    header = str(matrix.shape[0]) + " " + str(nkept)
+    names = phylip_names(ids, nkept)
+
+    with open(outfile, "wb", buffering=WRITE_BUFFER) as fout:
+        fout.write((header + "\n").encode())
+
+        if not interleaved:
+            for name, row in zip(names, matrix):
+                fout.write(name)
+                fout.write(row[keep])
+                fout.write(b"\n")
+        else:
+            for first in range(0, max(nkept, 1), interleaved):
+                if first:
+                    fout.write(b"\n")
+                block = matrix.take(columns[first:first + interleaved], axis=1)
+                for name, row in zip(names, block):
+                    if not first:
+                        fout.write(name)
+                    fout.write(row)
+                    fout.write(b"\n")
+
+# Reads the kept sites among the columns [first, last) of the sequence starting at 'start', yielding
+# them in pieces of at most 'block_size' columns
+def read_kept_sites(fin, start, first, last, keep, block_size):
+    for piece in range(first, last, block_size):
+        piece_end = min(piece + block_size, last)
+        yield read_sites(fin, start, piece, piece_end)[keep[piece:piece_end]]
+
+# Writes only variant sites to output file as write_phylip() does, streaming each sequence of the
+# alignment from the input file in blocks of columns
+def write_phylip_blocks(fin, outfile, ids, starts, keep, block_size, interleaved=0):
+    columns = np.flatnonzero(keep)
+    nkept = len(columns)
+
+    header = str(len(ids)) + " " + str(nkept)
+    names = phylip_names(ids, nkept)
+
+    with open(outfile, "wb", buffering=WRITE_BUFFER) as fout:
+        fout.write((header + "\n").encode())
+
+        if not interleaved:
+            for name, start in zip(names, starts):
+                fout.write(name)
+                for sites in read_kept_sites(fin, start, 0, len(keep), keep, block_size):
+                    fout.write(sites)
+                fout.write(b"\n")
+        else:
+            for first in range(0, max(nkept, 1), interleaved):
+                if first:
+                    fout.write(b"\n")
+                # Columns of the input spanned by this block of kept sites
+                block_columns = columns[first:first + interleaved]
+                span = (block_columns[0], block_columns[-1] + 1) if len(block_columns) else (0, 0)
+                for name, start in zip(names, starts):
+                    if not first:
+                        fout.write(name)
+                    for sites in read_kept_sites(fin, start, span[0], span[1], keep, block_size):
+                        fout.write(sites)
+                    fout.write(b"\n")
 
-    header = str(df_size[0]) + " " + str(df_size[1])
+######################################MAIN######################################################################
 
-    seq_lst = dframe.values.tolist()
-    sample_lst = dframe.index.tolist()
-    joined_seqs = list()
+if __name__ == "__main__":
 
-    [joined_seqs.append("".join(i)) for i in seq_lst]
+    start = time.time() # time library
 
-    with open(outfile, "w") as fout:
-        fout.write(header + "\n")
+    arguments = Get_Arguments() # argparse library
 
-        [fout.write("{}\t{:>15}\n".format(str(sample), str(seq)))
-        for sample, seq
-        in zip(sample_lst, joined_seqs)]
+    if arguments.max_memory is not None and Path(arguments.phylip).stat().st_size > arguments.max_memory * 1024 * 1024:
 
-######################################MAIN######################################################################
+        # Out-of-core mode for alignments larger than the memory allowed
+        # The alignment is read in blocks of columns, once to find the invariant sites and again to write
+        # the variant sites of each sequence
+        with open(arguments.phylip, "rb", buffering=0) as fin:
+            ids, starts, nsites = Index_Alignment(fin, arguments.strict)
+
+            # A block of columns takes 1 byte per base plus the bitmasks of its columns, one block per process
+            block_size = max(1, arguments.max_memory * 1024 * 1024 // (len(ids) + 8) // arguments.threads)
+
+            stam, fels, keep = filter_invariants_blocks(arguments.phylip, starts, nsites, block_size, arguments.threads)
+
+            write_phylip_blocks(fin, arguments.outfile, ids, starts, keep, block_size, arguments.interleaved)
+            write_counts(arguments.outfile, stam, fels)
 
-start = time.time() # time library
+    else:
 
-arguments = Get_Arguments() # argparse library
+        # With more than one thread the matrix is read into shared memory, where the worker processes
+        # read it without copying
+        shm = None
+        data = None
+        if arguments.threads > 1:
+            with open(arguments.phylip, "rb") as fin:
+                shape = Read_Header(fin)
+            shm = shared_memory.SharedMemory(create=True, size=max(1, shape[0] * shape[1]))
+            data = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
 
-data, ids = Read_Alignment(arguments.phylip) # Reads PHYLIP file using biopython's AlignIO
+        data, ids = Read_Alignment(arguments.phylip, arguments.strict, data) # Reads PHYLIP file into a matrix of bytes
 
-df = pd.DataFrame(data, ids) # Creates pandas DataFrame
+        # For every column of the matrix at once
+        # Drops column if it is invariant
+        # Counts number of invariant sites (Felsenstein)
+        # And counts number of invariant sites containing A C G and T (Stamatakis)
+        stam, fels, keep = filter_invariants(data, arguments.threads, shm)
 
-# For each column of pandas DataFrame
-# Drops column if it is invariant
-# Counts number of invariant sites (Felsenstein)
-# And counts number of invariant sites containing A C G and T (Stamatakis)
-stam, fels, df = filter_invariants(df)
+        write_output(data, keep, arguments.outfile, ids, stam, fels, arguments.interleaved)
 
-write_output(df, arguments.outfile, ids, stam, fels)
+        if shm is not None:
+            del data
+            shm.close()
+            shm.unlink()
 
-# Prints execution time for script
-end = time.time()
-delay = (end - start)
-print("\nExecution time: {} seconds\n".format(round(delay, 2)))
+    # Prints execution time for script
+    end = time.time()
+    delay = (end - start)
+    print("\nExecution time: {} seconds\n".format(round(delay, 2)))
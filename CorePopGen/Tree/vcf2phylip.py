@@ -4,8 +4,8 @@
 """
 The script converts a collection of SNPs in VCF format into a PHYLIP, FASTA,
 NEXUS, or binary NEXUS file for phylogenetic analysis. The code is optimized
-to process VCF files with sizes >1GB. For small VCF files the algorithm slows
-down as the number of taxa increases (but is still fast).
+to process VCF files with sizes >1GB. The matrix is transposed in memory in a
+single pass, or in blocks when it is larger than the memory allowed.
 
 Any ploidy is allowed, but binary NEXUS is produced only for diploid VCFs.
 """
@@ -17,9 +17,21 @@ __email__       = "e.ortiz.v@gmail.com"
 __date__        = "2023-07-07"
 
 import argparse
+import concurrent.futures
 import gzip
+import itertools
+import json
+import mmap
+import multiprocessing
+import operator
+import os
 import random
+import re
+import struct
 import sys
+import time
+import zlib
+from collections import deque
 from pathlib import Path
 
 # Dictionary of IUPAC ambiguities for nucleotides
@@ -58,25 +70,467 @@ GEN_BIN = {
     "1/1":"2",
     "1|1":"2",
 }
+GEN_BIN_CODES = {genotype.encode(): ord(state) for genotype, state in GEN_BIN.items()}
 
+# Approximate size in bytes of the chunks of lines read from the VCF
+READ_CHUNK = 50000
 
-def extract_sample_names(vcf_file):
+# Number of BGZF blocks decompressed together by each thread
+BGZF_BATCH = 16
+
+# Seconds between checkpoints of the progress of the conversion
+CHECKPOINT_INTERVAL = 60
+
+# Largest position in a VCF, used for regions without end
+MAX_POSITION = 2**31 - 1
+
+# Region given as CHROM, CHROM:BEG or CHROM:BEG-END followed by a comma or the end of the list, the
+# positions may have commas as thousands separators like in samtools
+REGION_PATTERN = re.compile(r"([^,:]+)(?::(\d+(?:,\d{3})*)(?:-(\d+(?:,\d{3})*)?)?)?(?:,|$)")
+
+# Name and extension of each output matrix
+MATRIX_FORMATS = {
+    "phylip"  : ("PHYLIP", ".phy"),
+    "fasta"   : ("FASTA", ".fasta"),
+    "nexus"   : ("NEXUS", ".nexus"),
+    "nexusbin": ("BINARY NEXUS", ".bin.nexus"),
+}
+
+# Output matrices are written through large buffers
+WRITE_BUFFER = 8 * 1024 * 1024
+
+# Maximum amount of data in a BGZF block (same as bgzip) and empty block marking the end of the file
+BGZF_BLOCK_SIZE = 65280
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# States of the nucleotide and binary matrices as packed in the temporal files, nucleotides take 4
+# bits plus one more that marks the lowercase states (alleles with a deletion), SNAPP states 2 bits
+NUCLEOTIDE_STATES = b"ACGTMRWSYKVHDBN-"
+SNAPP_STATES = b"012?"
+NUCLEOTIDE_PACK = bytes.maketrans(NUCLEOTIDE_STATES + NUCLEOTIDE_STATES.lower(), bytes(range(16)) * 2)
+LOWERCASE_PACK = bytes(int(chr(b).islower()) for b in range(256))
+SNAPP_PACK = bytes.maketrans(SNAPP_STATES, bytes(range(4)))
+
+# Header of the temporal files: magic string, version, bits per state and number of samples
+COLUMN_HEADER = struct.Struct("<6s2BI")
+COLUMN_MAGIC = b"VCFCOL"
+
+# Lookup tables of IUPAC codes for each genotype call, one table for each combination of REF and ALT
+CODE_TABLES = {}
+
+# GT is always the first subfield of the sample fields
+GT_FIELD = re.compile(rb"\t([^\t:]*)")
+
+
+def extract_sample_names(vcf_chunks):
+    """
+    Extract sample names from the chunks of lines of a VCF file, reading only up to the header line
+    '#CHROM'. The chunks that follow the header are returned to continue reading the records
+    """
+    for offset, vcf_chunk in vcf_chunks:
+        for i in range(len(vcf_chunk)):
+            if vcf_chunk[i].startswith(b"#CHROM"):
+                record = vcf_chunk[i].decode().strip("\r\n").split("\t")
+                sample_names = [record[j].replace("./", "") for j in range(9, len(record))]
+                return sample_names, itertools.chain([(offset, vcf_chunk[i+1:])], vcf_chunks)
+    return [], vcf_chunks
+
+
+def read_sample_list(samples, samples_file):
+    """
+    Get the list of sample names given separated by commas and/or one per line in a file
+    """
+    sample_list = []
+    if samples:
+        sample_list += [name for name in samples.split(",") if name]
+    if samples_file:
+        with open(samples_file) as sample_lines:
+            sample_list += [line.strip() for line in sample_lines if line.strip()]
+    return sample_list
+
+
+def parse_regions(regions, regions_file):
+    """
+    Get the list of regions given as 'CHROM', 'CHROM:BEG' or 'CHROM:BEG-END' separated by commas
+    (positions may use commas as thousands separators) and/or in a file with one region per line as
+    'CHROM<tab>BEG<tab>END' (1-based and inclusive, or 0-based if the file is a BED). Each region is
+    a tuple (CHROM, BEG, END), 1-based and inclusive
+    """
+    region_list = []
+    if regions:
+        position = 0
+        while position < len(regions):
+            if regions[position] == ",":
+                position += 1
+                continue
+            match = REGION_PATTERN.match(regions, position)
+            # A bare 'BEG-END' is the rest of a span with a misplaced thousands separator
+            if not match or re.fullmatch(r"\d*-\d*", match.group(1)):
+                raise ValueError("Invalid region '{}', expected CHROM, CHROM:BEG or "
+                                 "CHROM:BEG-END".format(regions[position:].split(",")[0]))
+            chrom, beg, end = match.groups()
+            region_list.append((chrom, int(beg.replace(",", "")) if beg else 1,
+                                int(end.replace(",", "")) if end else MAX_POSITION))
+            position = match.end()
+    if regions_file:
+        bed = regions_file.lower().endswith((".bed", ".bed.gz"))
+        opener = gzip.open if regions_file.lower().endswith(".gz") else open
+        with opener(regions_file, "rt") as region_lines:
+            for line in region_lines:
+                fields = line.strip().split("\t")
+                if not fields[0] or fields[0].startswith(("#", "track", "browser")):
+                    continue
+                beg = int(fields[1]) + bed if len(fields) > 1 else 1
+                end = int(fields[2]) if len(fields) > 2 else MAX_POSITION
+                region_list.append((fields[0], beg, end))
+    return region_list
+
+
+def is_bgzf(vcf_file):
+    """
+    Determine if the file is compressed in BGZF blocks (by bgzip) as opposed to plain gzip
+    """
+    with open(vcf_file, "rb") as handle:
+        header = handle.read(18)
+    return bool(header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC")
+
+
+def read_bgzf_raw(handle):
+    """
+    Read the BGZF block at the current position of the compressed file, returning its compressed
+    data without decompressing it and the size of the data once decompressed (None and 0 at the end
+    of the file)
+    """
+    header = handle.read(12)
+    if len(header) < 12:
+        return None, 0
+    if header[:4] != b"\x1f\x8b\x08\x04":
+        raise ValueError("Not a BGZF file, it must be compressed with bgzip")
+    extra = handle.read(struct.unpack("<H", header[10:12])[0])
+    # Find the BC subfield, which holds the total size of the block minus 1
+    block_size = None
+    i = 0
+    while i < len(extra):
+        length = struct.unpack("<H", extra[i+2:i+4])[0]
+        if extra[i:i+2] == b"BC":
+            block_size = struct.unpack("<H", extra[i+4:i+6])[0] + 1
+        i += 4 + length
+    if block_size is None:
+        raise ValueError("Not a BGZF file, it must be compressed with bgzip")
+    compressed = handle.read(block_size - 12 - len(extra) - 8)
+    return compressed, struct.unpack("<2I", handle.read(8))[1]
+
+
+def read_bgzf_block(handle, offset):
+    """
+    Read the BGZF block starting at 'offset' in the compressed file, returning its decompressed data
+    and the offset of the next block (data is None at the end of the file)
+    """
+    handle.seek(offset)
+    compressed, size = read_bgzf_raw(handle)
+    if compressed is None:
+        return None, offset
+    return zlib.decompress(compressed, -15), handle.tell()
+
+
+def decompress_bgzf_blocks(blocks):
+    """
+    Decompress a list of BGZF blocks and return their data joined
+    """
+    return b"".join([zlib.decompress(compressed, -15) for compressed in blocks])
+
+
+def read_bgzf_chunks(vcf_file, threads, start=0):
+    """
+    Yield chunks of lines of a BGZF file, with the offset in the decompressed data where each chunk
+    ends. The compressed blocks are read in batches and decompressed by a pool of threads (zlib
+    releases the GIL), while the data is split into lines in order. Reading can start at any offset
+    of the decompressed data, skipping the blocks before it without decompressing them
+    """
+    with open(vcf_file, "rb") as handle, \
+         concurrent.futures.ThreadPoolExecutor(max(1, threads)) as executor:
+        position = 0
+        while position < start:
+            block_offset = handle.tell()
+            compressed, size = read_bgzf_raw(handle)
+            if compressed is None or position + size > start:
+                handle.seek(block_offset)
+                break
+            position += size
+        skip = start - position
+        position = start
+        pending = deque()
+        remainder = b""
+        while 1:
+            # Keep a few batches of blocks being decompressed ahead of the lines being yielded
+            while len(pending) < 2 * max(1, threads):
+                blocks = []
+                while len(blocks) < BGZF_BATCH:
+                    compressed, size = read_bgzf_raw(handle)
+                    if compressed is None:
+                        break
+                    blocks.append(compressed)
+                if not blocks:
+                    break
+                pending.append(executor.submit(decompress_bgzf_blocks, blocks))
+            if not pending:
+                break
+            data = remainder + pending.popleft().result()[skip:]
+            skip = 0
+            end = data.rfind(b"\n") + 1
+            remainder = data[end:]
+            start = 0
+            while start < end:
+                cut = data.find(b"\n", min(start + READ_CHUNK, end - 1)) + 1
+                yield position + cut, data[start:cut].split(b"\n")
+                start = cut
+            position += end
+        if remainder:
+            yield position + len(remainder), [remainder]
+
+
+class BgzfReader:
     """
-    Extract sample names from VCF file
+    Read lines from a BGZF file starting at any virtual offset, as stored in tabix and CSI indices
+    (offset of the compressed block << 16 | offset of the line within the decompressed block)
+    """
+
+    def __init__(self, filename):
+        self.handle = open(filename, "rb")
+        self.block_offset = 0
+        self.next_offset = 0
+        self.block = b""
+        self.within = 0
+
+    def seek(self, virtual_offset):
+        self.block_offset = self.next_offset = virtual_offset >> 16
+        self.block = b""
+        self.load_block()
+        self.within = virtual_offset & 0xFFFF
+
+    def load_block(self):
+        # Skip empty blocks, like the one marking the end of the file
+        while self.block is not None and self.within >= len(self.block):
+            self.block_offset = self.next_offset
+            self.block, self.next_offset = read_bgzf_block(self.handle, self.next_offset)
+            self.within = 0
+
+    def tell(self):
+        self.load_block()
+        return self.block_offset << 16 | self.within
+
+    def readline(self):
+        line = b""
+        while 1:
+            self.load_block()
+            if self.block is None:
+                return line
+            end = self.block.find(b"\n", self.within) + 1
+            if end == 0:
+                line += self.block[self.within:]
+                self.within = len(self.block)
+            else:
+                line += self.block[self.within:end]
+                self.within = end
+                return line
+
+    def close(self):
+        self.handle.close()
+
+
+def read_index(vcf_file):
+    """
+    Read the tabix (.tbi) or CSI (.csi) index of a bgzipped VCF, returning the parameters of its
+    binning scheme and, for each sequence, its bins with their chunks of virtual offsets and the
+    smallest virtual offset of the records in each 16 kb window (tabix) or bin (CSI)
+    """
+    if Path(vcf_file+".tbi").exists():
+        with gzip.open(vcf_file+".tbi", "rb") as index_file:
+            data = index_file.read()
+        if data[:4] != b"TBI\x01":
+            raise ValueError("Malformed tabix index")
+        index = {"csi": False, "min_shift": 14, "depth": 5}
+        aux = 8
+    elif Path(vcf_file+".csi").exists():
+        with gzip.open(vcf_file+".csi", "rb") as index_file:
+            data = index_file.read()
+        min_shift, depth, l_aux = struct.unpack_from("<3i", data, 4)
+        if data[:4] != b"CSI\x01" or l_aux < 28:
+            raise ValueError("Malformed CSI index")
+        index = {"csi": True, "min_shift": min_shift, "depth": depth}
+        aux = 16
+    else:
+        return None
+    # Sequence names follow the tabix parameters, which are the auxiliary data of CSI indices
+    l_nm = struct.unpack_from("<i", data, aux + 24)[0]
+    names = data[aux+28:aux+28+l_nm].rstrip(b"\x00").split(b"\x00")
+    if index["csi"]:
+        i = aux + l_aux + 4
+    else:
+        i = aux + 28 + l_nm
+    index["refs"] = {}
+    for name in names:
+        bins = {}
+        n_bin = struct.unpack_from("<i", data, i)[0]
+        i += 4
+        for b in range(n_bin):
+            if index["csi"]:
+                bin_num, loffset, n_chunk = struct.unpack_from("<IQi", data, i)
+                i += 16
+            else:
+                bin_num, n_chunk = struct.unpack_from("<Ii", data, i)
+                loffset = 0
+                i += 8
+            chunks = struct.unpack_from("<{:d}Q".format(2 * n_chunk), data, i)
+            i += 16 * n_chunk
+            bins[bin_num] = (loffset, list(zip(chunks[::2], chunks[1::2])))
+        intervals = []
+        if not index["csi"]:
+            n_intv = struct.unpack_from("<i", data, i)[0]
+            intervals = struct.unpack_from("<{:d}Q".format(n_intv), data, i + 4)
+            i += 4 + 8 * n_intv
+        index["refs"][name.decode()] = (bins, intervals)
+    return index
+
+
+def region_bins(beg, end, min_shift, depth):
+    """
+    List the bins that overlap the 0-based half-open interval [beg, end) in a binning scheme with the
+    given minimum shift and depth (14 and 5 in tabix indices)
+    """
+    end = min(end, 1 << (min_shift + depth * 3)) - 1
+    bins = []
+    shift = min_shift + depth * 3
+    first = 0
+    for level in range(depth + 1):
+        bins.extend(range(first + (beg >> shift), first + (end >> shift) + 1))
+        shift -= 3
+        first += 1 << (level * 3)
+    return bins
+
+
+def read_region_chunks(vcf_file, index, regions, start=0):
+    """
+    Yield chunks of lines of a bgzipped VCF that overlap the regions, seeking directly to the blocks
+    listed in the index. Regions of the same sequence are merged and visited in the order of the
+    index, so records are returned once each and in the same order as in the VCF. Each chunk comes
+    with the total size of the lines returned so far, and lines up to 'start' bytes are skipped
+    """
+    merged = {}
+    for chrom, beg, end in sorted(regions, key=lambda region: (region[0], region[1])):
+        if chrom not in index["refs"]:
+            print("Sequence '{}' not found in the VCF index, region skipped".format(chrom))
+            continue
+        spans = merged.setdefault(chrom, [])
+        if spans and beg <= spans[-1][1] + 1:
+            spans[-1][1] = max(spans[-1][1], end)
+        else:
+            spans.append([beg, end])
+    vcf = BgzfReader(vcf_file)
+    vcf_chunk = []
+    chunk_size = 0
+    offset = 0
+    for chrom in [name for name in index["refs"] if name in merged]:
+        bins, intervals = index["refs"][chrom]
+        chrom_name = chrom.encode()
+        for beg, end in merged[chrom]:
+            # Smallest virtual offset where records overlapping the region can start, from the
+            # linear index in tabix or from the smallest bin indexed that contains BEG in CSI
+            min_offset = 0
+            if index["csi"]:
+                bin_num = ((1 << 3 * index["depth"]) - 1) // 7 + ((beg - 1) >> index["min_shift"])
+                while bin_num > 0 and bin_num not in bins:
+                    bin_num = (bin_num - 1) >> 3
+                if bin_num in bins:
+                    min_offset = bins[bin_num][0]
+            elif intervals:
+                min_offset = intervals[min((beg - 1) >> 14, len(intervals) - 1)]
+            chunks = []
+            for bin_num in region_bins(beg - 1, end, index["min_shift"], index["depth"]):
+                if bin_num in bins:
+                    chunks += [chunk for chunk in bins[bin_num][1] if chunk[1] > min_offset]
+            # Merge overlapping chunks so blocks are read only once
+            spans = []
+            for chunk_beg, chunk_end in sorted(chunks):
+                if spans and chunk_beg <= spans[-1][1]:
+                    spans[-1][1] = max(spans[-1][1], chunk_end)
+                else:
+                    spans.append([max(chunk_beg, min_offset), chunk_end])
+            for chunk_beg, chunk_end in spans:
+                vcf.seek(chunk_beg)
+                while vcf.tell() < chunk_end:
+                    line = vcf.readline()
+                    fields = line.split(b"\t", 4)
+                    if len(fields) < 5 or fields[0] != chrom_name:
+                        continue
+                    pos = int(fields[1])
+                    if pos > end:
+                        break
+                    if pos + len(fields[3]) - 1 >= beg:
+                        offset += len(line)
+                        if offset <= start:
+                            continue
+                        vcf_chunk.append(line)
+                        chunk_size += len(line)
+                        if chunk_size >= READ_CHUNK:
+                            yield offset, vcf_chunk
+                            vcf_chunk = []
+                            chunk_size = 0
+    vcf.close()
+    if vcf_chunk:
+        yield offset, vcf_chunk
+
+
+def read_mmap_chunks(vcf_file, start=0):
+    """
+    Yield chunks of lines of an uncompressed VCF file mapped in memory, with the offset where each
+    chunk ends. Lines are sliced directly from the mapping as bytes
+    """
+    with open(vcf_file, "rb") as handle, \
+         mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as vcf:
+        while start < len(vcf):
+            cut = vcf.find(b"\n", start + READ_CHUNK) + 1 or len(vcf)
+            yield cut, vcf[start:cut].split(b"\n")
+            start = cut
+
+
+def read_vcf_chunks(vcf_file, threads=1, start=0):
+    """
+    Yield chunks of lines of the VCF file as bytes, with the offset in the uncompressed file where
+    each chunk ends, starting at the offset 'start'. The file can be gzipped. Files compressed with
+    bgzip are decompressed in parallel by 'threads' threads, and uncompressed files are mapped in
+    memory when possible
     """
     if vcf_file.lower().endswith(".gz"):
+        if is_bgzf(vcf_file):
+            yield from read_bgzf_chunks(vcf_file, threads, start)
+            return
         opener = gzip.open
     else:
-        opener = open
-    sample_names = []
-    with opener(vcf_file, "rt") as vcf:
-        for line in vcf:
-            line = line.strip("\n")
-            if line.startswith("#CHROM"):
-                record = line.split("\t")
-                sample_names = [record[i].replace("./", "") for i in range(9, len(record))]
+        try:
+            yield from read_mmap_chunks(vcf_file, start)
+            return
+        except (ValueError, OSError):
+            # Empty files and special files (pipes, process substitution) cannot be mapped
+            opener = open
+    with opener(vcf_file, "rb") as vcf:
+        if start:
+            vcf.seek(start)
+        while 1:
+            # Load large chunks of file into memory
+            vcf_chunk = vcf.readlines(READ_CHUNK)
+            if not vcf_chunk:
                 break
-    return sample_names
+            start += sum(map(len, vcf_chunk))
+            yield start, vcf_chunk
+
+
+def split_record(line):
+    """
+    Split a VCF line into its 9 fixed columns and a single field holding all the sample columns,
+    which are only split as needed
+    """
+    return line.split(b"\t", 9)
 
 
 def is_anomalous(record, num_samples):
@@ -84,7 +538,7 @@ def is_anomalous(record, num_samples):
     Determine if the number of samples in current record corresponds to number of samples described
     in the line '#CHROM'
     """
-    return bool(len(record) != num_samples + 9)
+    return bool(len(record) != 10 or record[9].count(b"\t") != num_samples - 1)
 
 
 def is_snp(record):
@@ -93,58 +547,441 @@ def is_snp(record):
     (multinucleotide polymorphism)
     """
     # <NON_REF> must be replaced by the REF in the ALT field for GVCFs from GATK
-    alt = record[4].replace("<NON_REF>", record[3])
-    return bool(len(record[3]) == 1 and len(alt) - alt.count(",") == alt.count(",") + 1)
+    alt = record[4].replace(b"<NON_REF>", record[3])
+    return bool(len(record[3]) == 1 and len(alt) - alt.count(b",") == alt.count(b",") + 1)
 
 
 def num_genotypes(record, num_samples):
     """
     Get number of genotypes in VCF record, total number of samples - missing genotypes
     """
-    missing = 0
-    for i in range(9, num_samples + 9):
-        if record[i].startswith("."):
-            missing += 1
+    # Every sample field that starts with '.' is preceded by a tab, except the first one
+    missing = record[9].count(b"\t.") + record[9].startswith(b".")
     return num_samples - missing
 
 
-def get_matrix_column(record, num_samples, resolve_IUPAC):
+def get_genotype_calls(record):
     """
-    Transform a VCF record into a phylogenetic matrix column with nucleotides instead of numbers
+    Get the GT subfield of every sample in a VCF record, without looping over samples in Python
     """
-    nt_dict = {str(0): record[3].replace("-","*").upper(), ".": "N"}
-    # <NON_REF> must be replaced by the REF in the ALT field for GVCFs from GATK
-    alt = record[4].replace("-", "*").replace("<NON_REF>", nt_dict["0"])
-    alt = alt.split(",")
-    for n in range(len(alt)):
-        nt_dict[str(n+1)] = alt[n]
-    column = ""
-    for i in range(9, num_samples + 9):
-        geno_num = record[i].split(":")[0].replace("/", "").replace("|", "")
-        try:
-            geno_nuc = "".join(sorted(set([nt_dict[j] for j in geno_num])))
-        except KeyError:
-            return "malformed"
-        if resolve_IUPAC is False:
-            column += AMBIG[geno_nuc]
-        else:
-            column += AMBIG[nt_dict[random.choice(geno_num)]]
-    return column
+    return GT_FIELD.findall(b"\t" + record[9])
+
+
+def get_code_table(ref, alt):
+    """
+    Return the translation of alleles to nucleotides for the given REF and ALT, together with its
+    lookup table of IUPAC codes for each genotype call, which is filled as new genotypes are found
+    """
+    if (ref, alt) not in CODE_TABLES:
+        nt_dict = {str(0): ref.decode().replace("-","*").upper(), ".": "N"}
+        # <NON_REF> must be replaced by the REF in the ALT field for GVCFs from GATK
+        alleles = alt.decode().replace("-", "*").replace("<NON_REF>", nt_dict["0"]).split(",")
+        for n in range(len(alleles)):
+            nt_dict[str(n+1)] = alleles[n]
+        CODE_TABLES[(ref, alt)] = (nt_dict, {})
+    return CODE_TABLES[(ref, alt)]
+
+
+def get_matrix_columns(records, num_samples, resolve_IUPAC):
+    """
+    Transform a chunk of VCF records into phylogenetic matrix columns with nucleotides instead of
+    numbers, returned as bytes (None for malformed records). Each distinct genotype of a record is
+    translated only once through a lookup table and the column is then assembled in a single call
+    """
+    columns = []
+    for record in records:
+        genotypes = get_genotype_calls(record)
+        nt_dict, table = get_code_table(record[3], record[4])
+        codes = {}
+        for genotype in set(genotypes):
+            if genotype not in table:
+                geno_num = genotype.decode().replace("/", "").replace("|", "")
+                try:
+                    geno_nuc = "".join(sorted(set([nt_dict[j] for j in geno_num])))
+                    table[genotype] = ord(AMBIG[geno_nuc])
+                except KeyError:
+                    table[genotype] = None
+            codes[genotype] = table[genotype]
+        if None in codes.values():
+            columns.append(None)
+            continue
+        column = bytearray(map(codes.__getitem__, genotypes))
+        if resolve_IUPAC is True:
+            # Only heterozygous genotypes need to be resolved sample by sample
+            for i, genotype in enumerate(genotypes):
+                geno_num = genotype.decode().replace("/", "").replace("|", "")
+                if len(set(geno_num)) > 1:
+                    column[i] = ord(AMBIG[nt_dict[random.choice(geno_num)]])
+        columns.append(bytes(column))
+    return columns
+
+
+def get_matrix_columns_bin(records, num_samples):
+    """
+    Return alignment columns in NEXUS binary from a chunk of VCF records, if genotype is not diploid
+    with at most two alleles it will return '?' as state
+    """
+    columns = []
+    for record in records:
+        genotypes = get_genotype_calls(record)
+        codes = {genotype: GEN_BIN_CODES.get(genotype, ord("?")) for genotype in set(genotypes)}
+        columns.append(bytes(map(codes.__getitem__, genotypes)))
+    return columns
+
+
+def pack_bits(codes, bits):
+    """
+    Pack codes of 'bits' bits each (one per byte) into bytes, the first code of each byte in the
+    highest bits. The codes are combined as large integers so the work is done by Python in C
+    """
+    per_byte = 8 // bits
+    packed = 0
+    for k in range(per_byte):
+        packed |= int.from_bytes(codes[k::per_byte], "big") << (bits * (per_byte - 1 - k))
+    return packed.to_bytes(len(codes) // per_byte, "big")
+
+
+def column_width(num_samples, bits):
+    """
+    Return the size in bytes of a packed alignment column, nucleotide columns are padded to a multiple
+    of 8 samples to hold the nibbles followed by the lowercase bits, binary columns to a multiple of 4
+    """
+    if bits == 4:
+        return (num_samples + 7) // 8 * 5
+    return (num_samples + 3) // 4
+
+
+def pack_columns(columns, num_samples, bits):
+    """
+    Pack alignment columns into the fixed-width records of the temporal files, 4 bits per nucleotide
+    and 1 more for lowercase states, or 2 bits per binary state
+    """
+    if bits == 4:
+        padded = (num_samples + 7) // 8 * 8
+        states = b"".join(column + b"-" * (padded - num_samples) for column in columns)
+        nibbles = pack_bits(states.translate(NUCLEOTIDE_PACK), 4)
+        lowercase = pack_bits(states.translate(LOWERCASE_PACK), 1)
+        a, b = padded // 2, padded // 8
+        return b"".join(nibbles[i*a:(i+1)*a] + lowercase[i*b:(i+1)*b] for i in range(len(columns)))
+    padded = (num_samples + 3) // 4 * 4
+    states = b"".join(column + b"?" * (padded - num_samples) for column in columns)
+    return pack_bits(states.translate(SNAPP_PACK), 2)
+
+
+def unpack_table(states, bits, k):
+    """
+    Return the translation table from packed bytes to the state of the k-th code in each byte
+    """
+    shift = 8 - bits * (k + 1)
+    return bytes(states[(b >> shift) & (2**bits - 1)] for b in range(256))
+
+
+# Lookup tables to unpack the states of a sample from the bytes of the temporal files
+NUCLEOTIDE_UNPACK = [unpack_table(NUCLEOTIDE_STATES, 4, k) for k in range(2)]
+LOWERCASE_UNPACK = [unpack_table(b"\x00\x20", 1, k) for k in range(8)]
+SNAPP_UNPACK = [unpack_table(SNAPP_STATES, 2, k) for k in range(4)]
 
 
-def get_matrix_column_bin(record, num_samples):
+def unpack_sequence(matrix, start, s, num_samples, bits):
     """
-    Return an alignment column in NEXUS binary from a VCF record, if genotype is not diploid with at
-    most two alleles it will return '?' as state
+    Unpack the sequence of sample 's' from the packed columns in 'matrix' beginning at 'start', as a
+    strided slice translated through a lookup table. Lowercase states are set by adding the case bit
+    to the ASCII code of the uppercase state
     """
-    column = ""
-    for i in range(9, num_samples + 9):
-        genotype = record[i].split(":")[0]
-        if genotype in GEN_BIN:
-            column += GEN_BIN[genotype]
+    width = column_width(num_samples, bits)
+    if bits == 2:
+        return matrix[start+s//4::width].translate(SNAPP_UNPACK[s % 4])
+    seq = matrix[start+s//2::width].translate(NUCLEOTIDE_UNPACK[s % 2])
+    lowercase = matrix[start+width//5*4+s//8::width].translate(LOWERCASE_UNPACK[s % 8])
+    if b"\x20" in lowercase:
+        seq = (int.from_bytes(seq, "big") | int.from_bytes(lowercase, "big")).to_bytes(len(seq),
+                                                                                         "big")
+    return seq
+
+
+def filter_chunk(vcf_chunk, num_samples, sample_columns, min_samples_locus):
+    """
+    Filter a chunk of VCF lines (bytes), returning the counters of the chunk (number of genotypes
+    processed and rejected, and the malformed lines found) and the records that passed the filters
+    together with their number of samples. If 'sample_columns' is given only those samples (indices
+    among the samples of the VCF) are kept in each record
+    """
+    num_columns = num_samples
+    if sample_columns is not None:
+        project = operator.itemgetter(*sample_columns)
+        num_samples = len(sample_columns)
+    chunk = {"snp_num": 0, "snp_shallow": 0, "mnp_num": 0, "snp_accepted": 0, "snp_biallelic": 0,
+             "columns": b"", "columns_bin": b"", "used_sites": b"", "malformed": []}
+
+    # Records of the chunk that passed the filters, with their number of samples
+    snps = []
+    for line in vcf_chunk:
+        line = line.strip()
+
+        if line and not line.startswith(b"#"): # skip empty and commented lines
+            # Split line into fixed columns and samples
+            record = split_record(line)
+            # Keep track of number of genotypes processed
+            chunk["snp_num"] += 1
+            if is_anomalous(record, num_columns):
+                chunk["malformed"].append(line.decode(errors="replace"))
+                continue
+            else:
+                # Keep only the samples requested
+                if sample_columns is not None:
+                    samples = project(record[9].split(b"\t"))
+                    record[9] = b"\t".join(samples) if num_samples > 1 else samples
+                # Check if the SNP has the minimum number of samples required
+                num_samples_locus = num_genotypes(record, num_samples)
+                if  num_samples_locus < min_samples_locus:
+                    # Keep track of loci rejected due to exceeded missing data
+                    chunk["snp_shallow"] += 1
+                    continue
+                else:
+                    # Check that neither REF nor ALT contain MNPs
+                    if is_snp(record):
+                        snps.append((record, num_samples_locus))
+                    else:
+                        # Keep track of loci rejected due to multinucleotide genotypes
+                        chunk["mnp_num"] += 1
+
+    return chunk, snps
+
+
+def encode_chunk(chunk, snps, num_samples, nucleotides, binary, resolve_IUPAC, write_used):
+    """
+    Transform the records kept by 'filter_chunk' into packed rows of the nucleotide and binary
+    matrices, adding them to the results of the chunk with the number of genotypes accepted, the
+    coordinates of used sites and the records that could not be encoded
+    """
+    if nucleotides:
+        # Transform VCF records into alignment columns
+        columns = get_matrix_columns([snp[0] for snp in snps], num_samples, resolve_IUPAC)
+        accepted = []
+        for (record, num_samples_locus), site_tmp in zip(snps, columns):
+            if site_tmp is None:
+                chunk["malformed"].append(b"\t".join(record).decode(errors="replace"))
+            else:
+                accepted.append((record, num_samples_locus))
+        chunk["columns"] = pack_columns([site_tmp for site_tmp in columns if site_tmp is not None],
+                                        num_samples, 4)
+        if write_used:
+            chunk["used_sites"] = b"".join(record[0] + b"\t" + record[1] + b"\t"
+                                           + str(num_samples_locus).encode() + b"\n"
+                                           for record, num_samples_locus in accepted)
+        # Add to running sum of accepted SNPs
+        chunk["snp_accepted"] = len(accepted)
+        snps = accepted
+
+    # Binary NEXUS for SNAPP
+    if binary:
+        # Check that the SNP only has two alleles
+        biallelic = [record for record, num_samples_locus in snps if len(record[4]) == 1]
+        # Add to running sum of biallelic SNPs
+        chunk["snp_biallelic"] = len(biallelic)
+        # Translate genotype into 0 for homozygous REF, 1 for heterozygous, and 2 for homozygous ALT
+        chunk["columns_bin"] = pack_columns(get_matrix_columns_bin(biallelic, num_samples),
+                                            num_samples, 2)
+
+    return chunk
+
+
+def process_chunk(vcf_chunk, num_samples, sample_columns, min_samples_locus, nucleotides, binary,
+                  resolve_IUPAC, write_used):
+    """
+    Filter and transform a chunk of VCF lines (bytes) into rows of the nucleotide and binary
+    matrices, returning them together with the number of genotypes processed, rejected and accepted,
+    the coordinates of used sites and the malformed lines found in the chunk. If 'sample_columns' is
+    given only those samples (indices among the samples of the VCF) are kept in each record
+    """
+    chunk, snps = filter_chunk(vcf_chunk, num_samples, sample_columns, min_samples_locus)
+    if sample_columns is not None:
+        num_samples = len(sample_columns)
+    return encode_chunk(chunk, snps, num_samples, nucleotides, binary, resolve_IUPAC, write_used)
+
+
+def process_chunks(vcf_chunks, threads, *args):
+    """
+    Apply 'process_chunk' to every chunk of VCF lines, yielding the results in the same order as the
+    input together with the offset where each chunk ends. With more than one thread the chunks are
+    distributed to a pool of processes, keeping a limited number of chunks in flight so the VCF is
+    not loaded into memory faster than it is used
+    """
+    if threads <= 1:
+        for offset, vcf_chunk in vcf_chunks:
+            yield offset, process_chunk(vcf_chunk, *args)
+    else:
+        with multiprocessing.Pool(threads) as pool:
+            pending = deque()
+            for offset, vcf_chunk in vcf_chunks:
+                pending.append((offset, pool.apply_async(process_chunk, (vcf_chunk,) + args)))
+                if len(pending) >= threads * 4:
+                    offset, result = pending.popleft()
+                    yield offset, result.get()
+            while pending:
+                offset, result = pending.popleft()
+                yield offset, result.get()
+
+
+def read_checkpoint(outfile, settings):
+    """
+    Read the checkpoint of a previous conversion with the same input file and settings, returning
+    None if there is none or if its temporal files are missing or incomplete
+    """
+    try:
+        with open(outfile+".checkpoint") as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get("settings") != settings:
+        print("Checkpoint found but it does not match the input file or the options, starting "
+              "from the beginning")
+        return None
+    for filename, size in checkpoint["files"].items():
+        if not Path(filename).exists() or Path(filename).stat().st_size < size:
+            print("Checkpoint found but temporal file '{}' is incomplete, starting from the "
+                  "beginning".format(filename))
+            return None
+    return checkpoint
+
+
+def write_checkpoint(outfile, checkpoint, handles):
+    """
+    Save the progress of the conversion, once the temporal files are flushed to disk, recording
+    their current size so they can be truncated to it when resuming
+    """
+    checkpoint["files"] = {}
+    for handle in handles:
+        handle.flush()
+        os.fsync(handle.fileno())
+        checkpoint["files"][handle.name] = handle.tell()
+    # Replace the previous checkpoint only once the new one is complete
+    with open(outfile+".checkpoint.tmp", "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(outfile+".checkpoint.tmp", outfile+".checkpoint")
+
+
+def open_temporal(filename, checkpoint):
+    """
+    Open a temporal file for writing, when resuming from a checkpoint the data written up to the
+    checkpoint is kept and the rest discarded
+    """
+    if checkpoint is None:
+        return open(filename, "wb")
+    temporal = open(filename, "r+b")
+    temporal.truncate(checkpoint["files"][filename])
+    temporal.seek(0, 2)
+    return temporal
+
+
+def open_matrix(outfile, fmt, num_taxa, num_chars, compress):
+    """
+    Open an output matrix in the given format and write its header, returning the handle and the
+    filename. The matrix is written in binary mode through a large buffer and, if requested,
+    compressed with gzip or BGZF (blocked gzip as written by bgzip, which can be indexed)
+    """
+    filename = outfile + MATRIX_FORMATS[fmt][1]
+    if compress == "gzip":
+        filename += ".gz"
+        output = gzip.open(filename, "wb")
+    elif compress == "bgzip":
+        filename += ".gz"
+        output = BgzfWriter(filename)
+    else:
+        output = open(filename, "wb", buffering=WRITE_BUFFER)
+    if fmt == "phylip":
+        output.write("{:d} {:d}\n".format(num_taxa, num_chars).encode())
+    elif fmt == "nexus":
+        output.write("#NEXUS\n\nBEGIN DATA;\n\tDIMENSIONS NTAX={:d} NCHAR={:d};\n\tFORMAT "
+                     "DATATYPE=DNA MISSING=N GAP=- ;\nMATRIX\n".format(num_taxa, num_chars).encode())
+    elif fmt == "nexusbin":
+        output.write("#NEXUS\n\nBEGIN DATA;\n\tDIMENSIONS NTAX={:d} NCHAR={:d};\n\tFORMAT "
+                     "DATATYPE=SNP MISSING=? GAP=- ;\nMATRIX\n".format(num_taxa, num_chars).encode())
+    return output, filename
+
+
+def write_sequence(output, fmt, name, seq, len_longest_name):
+    """
+    Write the sequence of a sample to an output matrix, the sequence is passed as is to the output
+    buffer instead of being concatenated with the name
+    """
+    if fmt == "fasta":
+        output.write((">"+name+"\n").encode())
+    else:
+        # Pad sequences names in PHYLIP and NEXUS
+        padding = (len_longest_name + 3 - len(name)) * " "
+        output.write((name+padding).encode())
+    output.write(seq)
+    output.write(b"\n")
+
+
+class BgzfWriter:
+    """
+    Write a file in the BGZF format, a series of gzip members of at most 64 KB of data each
+    """
+
+    def __init__(self, filename, compresslevel=6):
+        self.handle = open(filename, "wb", buffering=WRITE_BUFFER)
+        self.compresslevel = compresslevel
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= BGZF_BLOCK_SIZE:
+            end = len(self.buffer) - len(self.buffer) % BGZF_BLOCK_SIZE
+            with memoryview(self.buffer) as view:
+                for start in range(0, end, BGZF_BLOCK_SIZE):
+                    self.write_block(view[start:start+BGZF_BLOCK_SIZE])
+            del self.buffer[:end]
+
+    def write_block(self, data):
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        # The BC extra subfield holds the total size of the block minus 1
+        self.handle.write(struct.pack("<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+                                      len(compressed) + 25))
+        self.handle.write(compressed)
+        self.handle.write(struct.pack("<2I", zlib.crc32(data), len(data)))
+
+    def close(self):
+        if self.buffer:
+            self.write_block(self.buffer)
+        self.handle.write(BGZF_EOF)
+        self.handle.close()
+
+
+def transpose_matrix(tmp_file, sample_order, max_memory):
+    """
+    Transpose a temporal file of packed alignment columns into sequences, yielding a tuple (sample
+    index, sequence) for each sample in 'sample_order'. The file is mapped in memory and, if it fits
+    in 'max_memory' bytes, each sequence is unpacked from strided slices of the whole mapping.
+    Otherwise the samples are transposed in groups, reading the columns in blocks once per group
+    """
+    with open(tmp_file, "rb") as tmp_seq, \
+         mmap.mmap(tmp_seq.fileno(), 0, access=mmap.ACCESS_READ) as matrix:
+        magic, version, bits, num_samples = COLUMN_HEADER.unpack_from(matrix)
+        if magic != COLUMN_MAGIC:
+            print("\nTemporal file '{}' is not a matrix of packed columns\n".format(tmp_file))
+            sys.exit()
+        width = column_width(num_samples, bits)
+        matrix_size = len(matrix) - COLUMN_HEADER.size
+        if matrix_size <= max_memory:
+            for s in sample_order:
+                yield s, unpack_sequence(matrix, COLUMN_HEADER.size, s, num_samples, bits)
         else:
-            column += "?"
-    return column
+            # Half of the memory holds the sequences of the group, the other half the block of columns
+            num_sites = matrix_size // width
+            group_size = max(1, max_memory // 2 // max(1, num_sites))
+            block_size = max(1, max_memory // 2 // width) * width
+            for g in range(0, len(sample_order), group_size):
+                group = sample_order[g:g+group_size]
+                seqs = [bytearray() for s in group]
+                for start in range(COLUMN_HEADER.size, len(matrix), block_size):
+                    block = matrix[start:start+block_size]
+                    for seq, s in zip(seqs, group):
+                        seq += unpack_sequence(block, 0, s, num_samples, bits)
+                for seq, s in zip(seqs, group):
+                    yield s, bytes(seq)
 
 
 def main():
@@ -205,6 +1042,51 @@ def main():
         dest = "write_used",
         help = "Save the list of coordinates that passed the filters and were used in the alignments "
                "(disabled by default)")
+    parser.add_argument("--regions",
+        action = "store",
+        dest = "regions",
+        help = "Comma-separated list of regions to convert as CHROM, CHROM:BEG or CHROM:BEG-END, "
+               "requires a VCF compressed with bgzip and indexed (.tbi or .csi)")
+    parser.add_argument("--regions-file",
+        action = "store",
+        dest = "regions_file",
+        help = "File with the regions to convert, one per line as CHROM, BEG and END separated by "
+               "tabs (1-based and inclusive, or 0-based if the file is a BED)")
+    parser.add_argument("--samples",
+        action = "store",
+        dest = "samples",
+        help = "Comma-separated list of samples to include in the matrices (all by default)")
+    parser.add_argument("--samples-file",
+        action = "store",
+        dest = "samples_file",
+        help = "File with the samples to include in the matrices, one per line")
+    parser.add_argument("-z", "--compress",
+        action = "store",
+        dest = "compress",
+        choices = ["gzip", "bgzip"],
+        help = "Compress the output matrices with gzip or bgzip, '.gz' is appended to their names "
+               "(disabled by default)")
+    parser.add_argument("-t", "--threads",
+        action = "store",
+        dest = "threads",
+        type = int,
+        default = 1,
+        help = "Number of processes used to filter and encode the VCF records, and of threads used to "
+               "decompress VCFs compressed with bgzip, the output is the same regardless of the "
+               "number of processes (default=1)")
+    parser.add_argument("--max-memory",
+        action = "store",
+        dest = "max_memory",
+        type = int,
+        default = 1024,
+        help = "Maximum memory in MB used to transpose the matrices, larger matrices are transposed in "
+               "blocks with additional passes over the temporal files (default=1024)")
+    parser.add_argument("--checkpoint",
+        action = "store_true",
+        dest = "checkpoint",
+        help = "Save the progress periodically and keep the temporal files, so a conversion that is "
+               "interrupted resumes from the last checkpoint when run again with the same options "
+               "(disabled by default)")
     parser.add_argument("-v", "--version",
         action = "version",
         version = "%(prog)s {version}".format(version=__version__))
@@ -214,7 +1096,8 @@ def main():
 
     # Get samples names and number of samples in VCF
     if Path(args.filename).exists():
-        sample_names = extract_sample_names(args.filename)
+        sample_names, vcf_chunks = extract_sample_names(read_vcf_chunks(args.filename,
+                                                                        args.threads))
     else:
         print("\nInput VCF file not found, please verify the provided path")
         sys.exit()
@@ -225,6 +1108,35 @@ def main():
     print("\nConverting file '{}':\n".format(args.filename))
     print("Number of samples in VCF: {:d}".format(num_samples))
 
+    # Keep only the samples requested, in the same order as in the VCF
+    num_columns = num_samples
+    sample_columns = None
+    if args.samples or args.samples_file:
+        sample_list = read_sample_list(args.samples, args.samples_file)
+        missing = [name for name in sample_list if name not in sample_names]
+        if missing:
+            print("\nSamples not found in VCF: {}\n".format(", ".join(missing)))
+            sys.exit()
+        sample_columns = [i for i in range(num_samples) if sample_names[i] in sample_list]
+        sample_names = [sample_names[i] for i in sample_columns]
+        num_samples = len(sample_names)
+        print("Number of samples selected: {:d}".format(num_samples))
+
+    # Seek to the regions requested through the index of the VCF
+    if args.regions or args.regions_file:
+        try:
+            regions = parse_regions(args.regions, args.regions_file)
+        except ValueError as error:
+            print("\n{}\n".format(error))
+            sys.exit()
+        index = read_index(args.filename)
+        if index is None:
+            print("\nIndex of the VCF not found, regions require a VCF compressed with bgzip and "
+                  "indexed with tabix or bcftools (.tbi or .csi)\n")
+            sys.exit()
+        print("Number of regions selected: {:d}".format(len(regions)))
+        vcf_chunks = read_region_chunks(args.filename, index, regions)
+
     # If the 'min_samples_locus' is larger than the actual number of samples in VCF readjust it
     args.min_samples_locus = min(num_samples, args.min_samples_locus)
 
@@ -246,118 +1158,125 @@ def main():
 
     outfile = str(Path(args.folder, args.prefix))
 
+    # If nucleotide matrices are requested
+    nucleotides = args.fasta or args.nexus or not args.phylipdisable
+
+    # Resume from the last checkpoint of a previous run with the same input file and options
+    checkpoint = None
+    if args.checkpoint:
+        vcf_stat = Path(args.filename).stat()
+        selected = None
+        if args.regions or args.regions_file:
+            selected = [list(region) for region in regions]
+        settings = {"input": str(Path(args.filename).resolve()), "size": vcf_stat.st_size,
+                    "mtime": vcf_stat.st_mtime, "samples": sample_names, "regions": selected,
+                    "min_samples_locus": args.min_samples_locus, "nucleotides": nucleotides,
+                    "nexusbin": args.nexusbin, "resolve_IUPAC": args.resolve_IUPAC,
+                    "write_used": args.write_used}
+        checkpoint = read_checkpoint(outfile, settings)
+        if checkpoint is not None:
+            print("Resuming from checkpoint, {:d} genotypes already processed".format(
+                                                                          checkpoint["snp_num"]))
+            if args.regions or args.regions_file:
+                vcf_chunks = read_region_chunks(args.filename, index, regions, checkpoint["offset"])
+            else:
+                vcf_chunks = read_vcf_chunks(args.filename, args.threads, checkpoint["offset"])
+        last_checkpoint = time.time()
+
     # We need to create an intermediate file to hold the sequence data vertically and then transpose
-    # it to create the matrices
-    if args.fasta or args.nexus or not args.phylipdisable:
-        temporal = open(outfile+".tmp", "w")
+    # it to create the matrices, the columns are packed in fixed-width records
+    temporals = []
+    if nucleotides:
+        temporal = open_temporal(outfile+".tmp", checkpoint)
+        temporals.append(temporal)
+        if checkpoint is None:
+            temporal.write(COLUMN_HEADER.pack(COLUMN_MAGIC, 1, 4, num_samples))
 
     # If binary NEXUS is selected also create a separate temporal
     if args.nexusbin:
-        temporalbin = open(outfile+".bin.tmp", "w")
+        temporalbin = open_temporal(outfile+".bin.tmp", checkpoint)
+        temporals.append(temporalbin)
+        if checkpoint is None:
+            temporalbin.write(COLUMN_HEADER.pack(COLUMN_MAGIC, 1, 2, num_samples))
 
 
     ##########################
     # PROCESS GENOTYPES IN VCF
 
     if args.write_used:
-        used_sites = open(outfile+".used_sites.tsv", "w")
-        used_sites.write("#CHROM\tPOS\tNUM_SAMPLES\n")
-
-    if args.filename.lower().endswith(".gz"):
-        opener = gzip.open
-    else:
-        opener = open
-
-    with opener(args.filename, "rt") as vcf:
-        # Initialize line counter
-        snp_num = 0
-        snp_accepted = 0
-        snp_shallow = 0
-        mnp_num = 0
-        snp_biallelic = 0
-
-        while 1:
-            # Load large chunks of file into memory
-            vcf_chunk = vcf.readlines(50000)
-            if not vcf_chunk:
-                break
-
-            for line in vcf_chunk:
-                line = line.strip()
-
-                if line and not line.startswith("#"): # skip empty and commented lines
-                    # Split line into columns
-                    record = line.split("\t")
-                    # Keep track of number of genotypes processed
-                    snp_num += 1
-                    # Print progress every 500000 lines
-                    if snp_num % 500000 == 0:
-                        print("{:d} genotypes processed.".format(snp_num))
-                    if is_anomalous(record, num_samples):
-                        print("Skipping malformed line:\n{}".format(line))
-                        continue
-                    else:
-                        # Check if the SNP has the minimum number of samples required
-                        num_samples_locus = num_genotypes(record, num_samples)
-                        if  num_samples_locus < args.min_samples_locus:
-                            # Keep track of loci rejected due to exceeded missing data
-                            snp_shallow += 1
-                            continue
-                        else:
-                            # Check that neither REF nor ALT contain MNPs
-                            if is_snp(record):
-                                # If nucleotide matrices are requested
-                                if args.fasta or args.nexus or not args.phylipdisable:
-                                    # Uncomment for debugging
-                                    # print(record)
-                                    # Transform VCF record into an alignment column
-                                    site_tmp = get_matrix_column(record, num_samples,
-                                                                 args.resolve_IUPAC)
-                                    # Uncomment for debugging
-                                    # print(site_tmp)
-                                    # Write entire row of single nucleotide genotypes to temp file
-                                    if site_tmp == "malformed":
-                                        print("Skipping malformed line:\n{}".format(line))
-                                        continue
-                                    else:
-                                        # Add to running sum of accepted SNPs
-                                        snp_accepted += 1
-                                        temporal.write(site_tmp+"\n")
-                                        if args.write_used:
-                                            used_sites.write(record[0] + "\t"
-                                                             + record[1] + "\t"
-                                                             + str(num_samples_locus) + "\n")
-                                # Write binary NEXUS for SNAPP if requested
-                                if args.nexusbin:
-                                    # Check that the SNP only has two alleles
-                                    if len(record[4]) == 1:
-                                        # Add to running sum of biallelic SNPs
-                                        snp_biallelic += 1
-                                        # Translate genotype into 0 for homozygous REF, 1 for
-                                        # heterozygous, and 2 for homozygous ALT
-                                        binsite_tmp = get_matrix_column_bin(record, num_samples)
-                                        # Write entire row to temporary file
-                                        temporalbin.write(binsite_tmp+"\n")
-                            else:
-                                # Keep track of loci rejected due to multinucleotide genotypes
-                                mnp_num += 1
-
-        # Print useful information about filtering of SNPs
-        print("Total of genotypes processed: {:d}".format(snp_num))
-        print("Genotypes excluded because they exceeded the amount "
-              "of missing data allowed: {:d}".format(snp_shallow))
-        print("Genotypes that passed missing data filter but were "
-              "excluded for being MNPs: {:d}".format(mnp_num))
-        print("SNPs that passed the filters: {:d}".format(snp_accepted))
+        used_sites = open_temporal(outfile+".used_sites.tsv", checkpoint)
+        temporals.append(used_sites)
+        if checkpoint is None:
+            used_sites.write(b"#CHROM\tPOS\tNUM_SAMPLES\n")
+
+    # Initialize line counter
+    snp_num = 0
+    snp_accepted = 0
+    snp_shallow = 0
+    mnp_num = 0
+    snp_biallelic = 0
+    if checkpoint is not None:
+        snp_num = checkpoint["snp_num"]
+        snp_accepted = checkpoint["snp_accepted"]
+        snp_shallow = checkpoint["snp_shallow"]
+        mnp_num = checkpoint["mnp_num"]
+        snp_biallelic = checkpoint["snp_biallelic"]
+
+    offset = 0
+    for offset, chunk in process_chunks(vcf_chunks, args.threads, num_columns, sample_columns,
+                                        args.min_samples_locus, nucleotides, args.nexusbin,
+                                        args.resolve_IUPAC, args.write_used):
+        # Print progress every 500000 lines
+        for n in range(snp_num // 500000 + 1, (snp_num + chunk["snp_num"]) // 500000 + 1):
+            print("{:d} genotypes processed.".format(n * 500000))
+        for line in chunk["malformed"]:
+            print("Skipping malformed line:\n{}".format(line))
+
+        # Keep track of number of genotypes processed, rejected and accepted
+        snp_num += chunk["snp_num"]
+        snp_shallow += chunk["snp_shallow"]
+        mnp_num += chunk["mnp_num"]
+        snp_accepted += chunk["snp_accepted"]
+        snp_biallelic += chunk["snp_biallelic"]
+
+        # Write entire rows of genotypes to temp files
+        if nucleotides:
+            temporal.write(chunk["columns"])
         if args.nexusbin:
-            print("Biallelic SNPs selected for binary NEXUS: {:d}".format(snp_biallelic))
+            temporalbin.write(chunk["columns_bin"])
+        if args.write_used:
+            used_sites.write(chunk["used_sites"])
+
+        # Save progress periodically
+        if args.checkpoint and time.time() - last_checkpoint >= CHECKPOINT_INTERVAL:
+            write_checkpoint(outfile, {"settings": settings, "offset": offset, "snp_num": snp_num,
+                                       "snp_accepted": snp_accepted, "snp_shallow": snp_shallow,
+                                       "mnp_num": mnp_num, "snp_biallelic": snp_biallelic},
+                             temporals)
+            last_checkpoint = time.time()
+
+    # Print useful information about filtering of SNPs
+    print("Total of genotypes processed: {:d}".format(snp_num))
+    print("Genotypes excluded because they exceeded the amount "
+          "of missing data allowed: {:d}".format(snp_shallow))
+    print("Genotypes that passed missing data filter but were "
+          "excluded for being MNPs: {:d}".format(mnp_num))
+    print("SNPs that passed the filters: {:d}".format(snp_accepted))
+    if args.nexusbin:
+        print("Biallelic SNPs selected for binary NEXUS: {:d}".format(snp_biallelic))
+
+    # Save the end of the VCF as checkpoint, so only the matrices are written if interrupted later
+    if args.checkpoint and (checkpoint is None or offset > checkpoint["offset"]):
+        write_checkpoint(outfile, {"settings": settings, "offset": offset, "snp_num": snp_num,
+                                   "snp_accepted": snp_accepted, "snp_shallow": snp_shallow,
+                                   "mnp_num": mnp_num, "snp_biallelic": snp_biallelic}, temporals)
 
     if args.write_used:
         print("Used sites saved to: '" + outfile + ".used_sites.tsv'")
         used_sites.close()
     print("")
 
-    if args.fasta or args.nexus or not args.phylipdisable:
+    if nucleotides:
         temporal.close()
     if args.nexusbin:
         temporalbin.close()
@@ -366,25 +1285,6 @@ def main():
     #######################
     # WRITE OUTPUT MATRICES
 
-    if not args.phylipdisable:
-        output_phy = open(outfile+".phy", "w")
-        output_phy.write("{:d} {:d}\n".format(len(sample_names), snp_accepted))
-
-    if args.fasta:
-        output_fas = open(outfile+".fasta", "w")
-
-    if args.nexus:
-        output_nex = open(outfile+".nexus", "w")
-        output_nex.write("#NEXUS\n\nBEGIN DATA;\n\tDIMENSIONS NTAX={:d} NCHAR={:d};\n\tFORMAT "
-                         "DATATYPE=DNA MISSING=N GAP=- ;\nMATRIX\n".format(len(sample_names),
-                                                                                      snp_accepted))
-
-    if args.nexusbin:
-        output_nexbin = open(outfile+".bin.nexus", "w")
-        output_nexbin.write("#NEXUS\n\nBEGIN DATA;\n\tDIMENSIONS NTAX={:d} NCHAR={:d};\n\tFORMAT "
-                            "DATATYPE=SNP MISSING=? GAP=- ;\nMATRIX\n".format(len(sample_names),
-                                                                                     snp_biallelic))
-
     # Get length of longest sequence name
     len_longest_name = 0
     for name in sample_names:
@@ -395,106 +1295,64 @@ def main():
     idx_outgroup = None
     if outgroup in sample_names:
         idx_outgroup = sample_names.index(outgroup)
+    sample_order = [s for s in range(len(sample_names)) if s != idx_outgroup]
+    if idx_outgroup is not None:
+        sample_order.insert(0, idx_outgroup)
 
-        if args.fasta or args.nexus or not args.phylipdisable:
-            with open(outfile+".tmp") as tmp_seq:
-                seqout = ""
+    max_memory = args.max_memory * 1024 * 1024
 
-                # This is where the transposing happens
-                for line in tmp_seq:
-                    seqout += line[idx_outgroup]
-
-                # Write FASTA line
-                if args.fasta:
-                    output_fas.write(">"+sample_names[idx_outgroup]+"\n"+seqout+"\n")
-
-                # Pad sequences names and write PHYLIP or NEXUS lines
-                padding = (len_longest_name + 3 - len(sample_names[idx_outgroup])) * " "
-                if not args.phylipdisable:
-                    output_phy.write(sample_names[idx_outgroup]+padding+seqout+"\n")
-                if args.nexus:
-                    output_nex.write(sample_names[idx_outgroup]+padding+seqout+"\n")
-
-                # Print current progress
+    # Open every matrix requested, nucleotide matrices share a single transposition
+    matrices = []
+    if not args.phylipdisable:
+        matrices.append("phylip")
+    if args.fasta:
+        matrices.append("fasta")
+    if args.nexus:
+        matrices.append("nexus")
+    outputs = {}
+    for fmt in matrices + (["nexusbin"] if args.nexusbin else []):
+        num_chars = snp_biallelic if fmt == "nexusbin" else snp_accepted
+        outputs[fmt] = open_matrix(outfile, fmt, len(sample_names), num_chars, args.compress)
+
+    # Write sequences, the whole matrix is transposed in a single pass over the temporal file unless
+    # it does not fit in the memory allowed
+    if nucleotides:
+        for s, seqout in transpose_matrix(outfile+".tmp", sample_order, max_memory):
+            for fmt in matrices:
+                write_sequence(outputs[fmt][0], fmt, sample_names[s], seqout, len_longest_name)
+
+            # Print current progress
+            if s == idx_outgroup:
                 print("Outgroup, '{}', added to the matrix(ces).".format(outgroup))
+            else:
+                print("Sample {:d} of {:d}, '{}', added to the nucleotide matrix(ces).".format(
+                                                       s+1, len(sample_names), sample_names[s]))
 
-        if args.nexusbin:
-            with open(outfile+".bin.tmp") as bin_tmp_seq:
-                seqout = ""
-
-                # This is where the transposing happens
-                for line in bin_tmp_seq:
-                    seqout += line[idx_outgroup]
-
-                # Write line of binary SNPs to NEXUS
-                padding = (len_longest_name + 3 - len(sample_names[idx_outgroup])) * " "
-                output_nexbin.write(sample_names[idx_outgroup]+padding+seqout+"\n")
+    if args.nexusbin:
+        for s, seqout in transpose_matrix(outfile+".bin.tmp", sample_order, max_memory):
+            write_sequence(outputs["nexusbin"][0], "nexusbin", sample_names[s], seqout,
+                           len_longest_name)
 
-                # Print current progress
+            # Print current progress
+            if s == idx_outgroup:
                 print("Outgroup, '{}', added to the binary matrix.".format(outgroup))
-
-    # Write sequences of the ingroup
-    for s in range(0, len(sample_names)):
-        if s != idx_outgroup:
-            if args.fasta or args.nexus or not args.phylipdisable:
-                with open(outfile+".tmp") as tmp_seq:
-                    seqout = ""
-
-                    # This is where the transposing happens
-                    for line in tmp_seq:
-                        seqout += line[s]
-
-                    # Write FASTA line
-                    if args.fasta:
-                        output_fas.write(">"+sample_names[s]+"\n"+seqout+"\n")
-
-                    # Pad sequences names and write PHYLIP or NEXUS lines
-                    padding = (len_longest_name + 3 - len(sample_names[s])) * " "
-                    if not args.phylipdisable:
-                        output_phy.write(sample_names[s]+padding+seqout+"\n")
-                    if args.nexus:
-                        output_nex.write(sample_names[s]+padding+seqout+"\n")
-
-                    # Print current progress
-                    print("Sample {:d} of {:d}, '{}', added to the nucleotide matrix(ces).".format(
-                                                           s+1, len(sample_names), sample_names[s]))
-
-            if args.nexusbin:
-                with open(outfile+".bin.tmp") as bin_tmp_seq:
-                    seqout = ""
-
-                    # This is where the transposing happens
-                    for line in bin_tmp_seq:
-                        seqout += line[s]
-
-                    # Write line of binary SNPs to NEXUS
-                    padding = (len_longest_name + 3 - len(sample_names[s])) * " "
-                    output_nexbin.write(sample_names[s]+padding+seqout+"\n")
-
-                    # Print current progress
-                    print("Sample {:d} of {:d}, '{}', added to the binary matrix.".format(
-                                                           s+1, len(sample_names), sample_names[s]))
+            else:
+                print("Sample {:d} of {:d}, '{}', added to the binary matrix.".format(
+                                                       s+1, len(sample_names), sample_names[s]))
 
     print()
-    if not args.phylipdisable:
-        print("PHYLIP matrix saved to: " + outfile+".phy")
-        output_phy.close()
-    if args.fasta:
-        print("FASTA matrix saved to: " + outfile+".fasta")
-        output_fas.close()
-    if args.nexus:
-        output_nex.write(";\nEND;\n")
-        print("NEXUS matrix saved to: " + outfile+".nex")
-        output_nex.close()
-    if args.nexusbin:
-        output_nexbin.write(";\nEND;\n")
-        print("BINARY NEXUS matrix saved to: " + outfile+".bin.nex")
-        output_nexbin.close()
+    for fmt, (output, filename) in outputs.items():
+        if fmt in ["nexus", "nexusbin"]:
+            output.write(b";\nEND;\n")
+        output.close()
+        print("{} matrix saved to: {}".format(MATRIX_FORMATS[fmt][0], filename))
 
-    if args.fasta or args.nexus or not args.phylipdisable:
+    if nucleotides:
         Path(outfile+".tmp").unlink()
     if args.nexusbin:
         Path(outfile+".bin.tmp").unlink()
+    if args.checkpoint:
+        Path(outfile+".checkpoint").unlink()
 
     print( "\nDone!\n")
 
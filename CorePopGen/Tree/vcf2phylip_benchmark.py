@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the throughput of vcf2phylip.py on a synthetic VCF. The VCF is
+simulated with the number of samples, SNPs, ploidy, missing data and fraction
+of multiallelic, multinucleotide and <NON_REF> records requested, and each
+stage of the conversion (header extraction, filtering, column encoding,
+transposition and writing of the matrices) is timed separately, followed by
+complete runs of the script. Results are printed as JSON to track regressions
+across versions, no network access or additional packages are required.
+"""
+
+import argparse
+import gzip
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import vcf2phylip
+
+NUCLEOTIDES = "ACGT"
+
+# Depth added to every genotype so samples have more than the GT subfield
+SAMPLE_DEPTH = ":12"
+
+
+def peak_rss():
+    """
+    Return the peak resident memory of this process in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def simulate_record(chrom, pos, num_samples, ploidy, missing, multiallelic, mnp, non_ref):
+    """
+    Return a random VCF record as a line of text, genotypes are drawn from allele frequencies
+    chosen at random for each record
+    """
+    if random.random() < mnp:
+        ref = "".join(random.choices(NUCLEOTIDES, k=2))
+        alts = ["".join(random.choices(NUCLEOTIDES, k=2))]
+    else:
+        ref = random.choice(NUCLEOTIDES)
+        num_alts = random.randint(2, 3) if random.random() < multiallelic else 1
+        alts = random.sample([n for n in NUCLEOTIDES if n != ref], num_alts)
+    if random.random() < non_ref:
+        alts.append("<NON_REF>")
+
+    # Every combination of alleles is a possible genotype, plus the missing genotype
+    freqs = [random.random() + 0.1 for allele in range(len(alts) + 1)]
+    sep = random.choice("/|")
+    calls = [sep.join(["."] * ploidy)]
+    weights = [missing * sum(freqs) ** ploidy]
+    for alleles in itertools.product(range(len(freqs)), repeat=ploidy):
+        calls.append(sep.join(str(a) for a in alleles))
+        weight = 1 - missing
+        for a in alleles:
+            weight *= freqs[a]
+        weights.append(weight)
+    genotypes = random.choices(calls, weights, k=num_samples)
+    return "\t".join([chrom, str(pos), ".", ref, ",".join(alts), ".", "PASS", ".", "GT:DP",
+                      (SAMPLE_DEPTH + "\t").join(genotypes) + SAMPLE_DEPTH]) + "\n"
+
+
+def simulate_vcf(filename, num_samples, num_snps, ploidy, missing, multiallelic, mnp, non_ref,
+                 compress):
+    """
+    Write a synthetic VCF with 'num_snps' records for 'num_samples' samples, compressed with gzip
+    or bgzip if requested
+    """
+    if compress == "gzip":
+        vcf = gzip.open(filename, "wb")
+    elif compress == "bgzip":
+        vcf = vcf2phylip.BgzfWriter(filename)
+    else:
+        vcf = open(filename, "wb", buffering=vcf2phylip.WRITE_BUFFER)
+    vcf.write(b"##fileformat=VCFv4.2\n")
+    vcf.write(b'##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+    vcf.write(b'##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">\n')
+    header = ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"]
+    header += ["sample{:d}".format(i+1) for i in range(num_samples)]
+    vcf.write(("\t".join(header) + "\n").encode())
+    for i in range(num_snps):
+        vcf.write(simulate_record("chr1", i+1, num_samples, ploidy, missing, multiallelic, mnp,
+                                  non_ref).encode())
+    vcf.close()
+
+
+def stage_result(seconds, records, size):
+    """
+    Summarize a stage with its time, the records or sites processed per second and the MB of data
+    processed per second. The peak RSS is that of the whole process up to the end of the stage, so
+    it includes every earlier stage and never decreases
+    """
+    return {"seconds": round(seconds, 4),
+            "records": records,
+            "records_per_s": round(records / seconds, 1) if seconds and records else None,
+            "mb_per_s": round(size / 1024 / 1024 / seconds, 2) if seconds and size else None,
+            "cumulative_peak_rss_mb": round(peak_rss(), 1)}
+
+
+def benchmark_stages(vcf_file, work_dir, min_samples_locus, max_memory, compress):
+    """
+    Time each stage of the conversion in this process, using the functions of vcf2phylip.py in the
+    same order as the script does. Reading the VCF is included in the filtering stage
+    """
+    stages = {}
+
+    # Header extraction
+    start = time.perf_counter()
+    vcf_chunks = vcf2phylip.read_vcf_chunks(vcf_file)
+    sample_names, vcf_chunks = vcf2phylip.extract_sample_names(vcf_chunks)
+    stages["header"] = stage_result(time.perf_counter() - start, 0, 0)
+    num_samples = len(sample_names)
+
+    filtering = 0
+    encoding = 0
+    num_records = 0
+    vcf_size = 0
+    num_sites = 0
+    num_sites_bin = 0
+    temporal = open(Path(work_dir, "benchmark.tmp"), "wb")
+    temporal.write(vcf2phylip.COLUMN_HEADER.pack(vcf2phylip.COLUMN_MAGIC, 1, 4, num_samples))
+    temporalbin = open(Path(work_dir, "benchmark.bin.tmp"), "wb")
+    temporalbin.write(vcf2phylip.COLUMN_HEADER.pack(vcf2phylip.COLUMN_MAGIC, 1, 2, num_samples))
+    while 1:
+        # Filtering, with the checks of 'process_chunk'
+        start = time.perf_counter()
+        offset, vcf_chunk = next(vcf_chunks, (None, None))
+        if vcf_chunk is None:
+            filtering += time.perf_counter() - start
+            break
+        chunk, snps = vcf2phylip.filter_chunk(vcf_chunk, num_samples, None, min_samples_locus)
+        filtering += time.perf_counter() - start
+        vcf_size += sum(len(line) for line in vcf_chunk)
+        num_records += chunk["snp_num"]
+
+        # Column encoding, for the nucleotide and binary matrices
+        start = time.perf_counter()
+        chunk = vcf2phylip.encode_chunk(chunk, snps, num_samples, True, True, False, False)
+        temporal.write(chunk["columns"])
+        temporalbin.write(chunk["columns_bin"])
+        encoding += time.perf_counter() - start
+        num_sites += chunk["snp_accepted"]
+        num_sites_bin += chunk["snp_biallelic"]
+    temporal.close()
+    temporalbin.close()
+    stages["filtering"] = stage_result(filtering, num_records, vcf_size)
+    stages["encoding"] = stage_result(encoding, num_sites, num_sites * num_samples)
+
+    # Transposition and writing are timed separately while consuming the same sequences
+    transposing = 0
+    writing = 0
+    outfile = str(Path(work_dir, "benchmark"))
+    outputs = {fmt: vcf2phylip.open_matrix(outfile, fmt, num_samples,
+                                           num_sites_bin if fmt == "nexusbin" else num_sites,
+                                           compress)[0]
+               for fmt in vcf2phylip.MATRIX_FORMATS}
+    len_longest_name = max(len(name) for name in sample_names)
+    for tmp_file, formats in [(outfile+".tmp", ["phylip", "fasta", "nexus"]),
+                              (outfile+".bin.tmp", ["nexusbin"])]:
+        sequences = vcf2phylip.transpose_matrix(tmp_file, list(range(num_samples)), max_memory)
+        while 1:
+            start = time.perf_counter()
+            s, seq = next(sequences, (None, None))
+            transposing += time.perf_counter() - start
+            if seq is None:
+                break
+            start = time.perf_counter()
+            for fmt in formats:
+                vcf2phylip.write_sequence(outputs[fmt], fmt, sample_names[s], seq,
+                                          len_longest_name)
+            writing += time.perf_counter() - start
+    start = time.perf_counter()
+    for fmt, output in outputs.items():
+        if fmt in ["nexus", "nexusbin"]:
+            output.write(b";\nEND;\n")
+        output.close()
+    writing += time.perf_counter() - start
+    matrix_size = (num_sites + num_sites_bin) * num_samples
+    stages["transpose"] = stage_result(transposing, num_sites + num_sites_bin, matrix_size)
+    stages["writing"] = stage_result(writing, num_sites + num_sites_bin,
+                                     (num_sites * 3 + num_sites_bin) * num_samples)
+    return stages, num_records, vcf_size
+
+
+def benchmark_script(vcf_file, work_dir, threads, min_samples_locus, max_memory, compress):
+    """
+    Time a complete run of vcf2phylip.py writing every matrix, returning its results with the peak
+    memory of the main process of the run
+    """
+    command = [sys.executable, str(Path(vcf2phylip.__file__).resolve()), "-i", vcf_file,
+               "--output-folder", str(Path(work_dir, "threads{:d}".format(threads))),
+               "-m", str(min_samples_locus), "-f", "-n", "-b", "-t", str(threads),
+               "--max-memory", str(max_memory // 1024 // 1024)]
+    if compress:
+        command += ["-z", compress]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    pid, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        print("\nvcf2phylip.py failed with {:d} threads\n".format(threads))
+        sys.exit()
+    return {"threads": threads,
+            "seconds": round(seconds, 4),
+            "peak_rss_mb": round(usage.ru_maxrss / 1024 / (1024 if sys.platform == "darwin"
+                                                           else 1), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-i", "--input",
+        action = "store",
+        dest = "filename",
+        help = "Benchmark an existing VCF instead of simulating one")
+    parser.add_argument("-s", "--samples",
+        action = "store",
+        dest = "samples",
+        type = int,
+        default = 100,
+        help = "Number of samples in the simulated VCF (default=100)")
+    parser.add_argument("-n", "--snps",
+        action = "store",
+        dest = "snps",
+        type = int,
+        default = 100000,
+        help = "Number of records in the simulated VCF (default=100000)")
+    parser.add_argument("-p", "--ploidy",
+        action = "store",
+        dest = "ploidy",
+        type = int,
+        default = 2,
+        help = "Ploidy of the simulated genotypes (default=2)")
+    parser.add_argument("--missing",
+        action = "store",
+        dest = "missing",
+        type = float,
+        default = 0.1,
+        help = "Fraction of missing genotypes (default=0.1)")
+    parser.add_argument("--multiallelic",
+        action = "store",
+        dest = "multiallelic",
+        type = float,
+        default = 0.05,
+        help = "Fraction of records with more than one ALT allele (default=0.05)")
+    parser.add_argument("--mnp",
+        action = "store",
+        dest = "mnp",
+        type = float,
+        default = 0.02,
+        help = "Fraction of multinucleotide records, which are rejected by the filters "
+               "(default=0.02)")
+    parser.add_argument("--non-ref",
+        action = "store",
+        dest = "non_ref",
+        type = float,
+        default = 0.0,
+        help = "Fraction of records with <NON_REF> among the ALT alleles, as in GATK GVCFs "
+               "(default=0)")
+    parser.add_argument("--vcf-compress",
+        action = "store",
+        dest = "vcf_compress",
+        choices = ["gzip", "bgzip"],
+        help = "Compress the simulated VCF with gzip or bgzip (uncompressed by default)")
+    parser.add_argument("-m", "--min-samples-locus",
+        action = "store",
+        dest = "min_samples_locus",
+        type = int,
+        default = 4,
+        help = "Minimum of samples required to be present at a locus (default=4)")
+    parser.add_argument("-z", "--compress",
+        action = "store",
+        dest = "compress",
+        choices = ["gzip", "bgzip"],
+        help = "Compress the output matrices with gzip or bgzip (uncompressed by default)")
+    parser.add_argument("-t", "--threads",
+        action = "store",
+        dest = "threads",
+        default = "1",
+        help = "Comma-separated numbers of threads for the complete runs of vcf2phylip.py, use 0 "
+               "to skip them (default=1)")
+    parser.add_argument("--max-memory",
+        action = "store",
+        dest = "max_memory",
+        type = int,
+        default = 1024,
+        help = "Maximum memory in MB to transpose the matrix (default=1024)")
+    parser.add_argument("--seed",
+        action = "store",
+        dest = "seed",
+        type = int,
+        default = 1,
+        help = "Seed of the random number generator for the simulation (default=1)")
+    parser.add_argument("-o", "--output",
+        action = "store",
+        dest = "output",
+        help = "Save the JSON results to this file instead of printing them")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    threads = [int(t) for t in args.threads.split(",") if int(t) > 0]
+    max_memory = args.max_memory * 1024 * 1024
+
+    with tempfile.TemporaryDirectory(prefix="vcf2phylip_benchmark_") as work_dir:
+        dataset = {}
+        if args.filename:
+            vcf_file = args.filename
+        else:
+            vcf_file = str(Path(work_dir, "simulated.vcf" + (".gz" if args.vcf_compress else "")))
+            start = time.perf_counter()
+            simulate_vcf(vcf_file, args.samples, args.snps, args.ploidy, args.missing,
+                         args.multiallelic, args.mnp, args.non_ref, args.vcf_compress)
+            dataset = {"samples": args.samples, "snps": args.snps, "ploidy": args.ploidy,
+                       "missing": args.missing, "multiallelic": args.multiallelic,
+                       "mnp": args.mnp, "non_ref": args.non_ref, "seed": args.seed,
+                       "simulation_seconds": round(time.perf_counter() - start, 4)}
+        stages, num_records, vcf_size = benchmark_stages(vcf_file, work_dir, args.min_samples_locus,
+                                                         max_memory, args.compress)
+        dataset.update({"input": vcf_file if args.filename else None,
+                        "records": num_records,
+                        "vcf_mb": round(vcf_size / 1024 / 1024, 2),
+                        "file_mb": round(Path(vcf_file).stat().st_size / 1024 / 1024, 2)})
+        runs = []
+        for t in threads:
+            run = benchmark_script(vcf_file, work_dir, t, args.min_samples_locus, max_memory,
+                                   args.compress)
+            run["records_per_s"] = round(num_records / run["seconds"], 1)
+            run["mb_per_s"] = round(vcf_size / 1024 / 1024 / run["seconds"], 2)
+            runs.append(run)
+
+    results = {"vcf2phylip_version": vcf2phylip.__version__,
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "dataset": dataset,
+               "stages": stages,
+               "runs": runs}
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+            output.write("\n")
+        print("Benchmark results saved to: " + args.output)
+    else:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()